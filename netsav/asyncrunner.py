@@ -0,0 +1,238 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/asyncrunner module
+
+It provide a dedicated asyncio event loop on which coroutine triggers run
+"""
+
+# System imports
+import asyncio
+from collections import deque
+import contextlib
+import contextvars
+import threading
+import time
+
+# Projet Imports
+
+
+# the clock of the running coroutine, seen by all its tasks
+_clock = contextvars.ContextVar('netsav_clock', default=None)
+
+
+class RunClock:
+  """The running time of a coroutine, without the time spent waiting for a
+  concurrency slot
+  """
+
+  def __init__(self):
+    """Constructor : Start the clock
+    """
+    self._start = time.monotonic()
+    self._waited = 0.0
+    self._wait_since = None
+
+  def elapsed(self):
+    """Return the number of seconds the coroutine has been running
+
+    @return[float] : the running time
+    """
+    now = time.monotonic()
+    waited = self._waited
+    if self._wait_since is not None:
+      waited += now - self._wait_since
+    return now - self._start - waited
+
+  def pause(self):
+    """Stop counting the running time
+    """
+    self._wait_since = time.monotonic()
+
+  def resume(self):
+    """Count the running time again
+    """
+    if self._wait_since is not None:
+      self._waited += time.monotonic() - self._wait_since
+      self._wait_since = None
+
+
+@contextlib.asynccontextmanager
+async def acquire(semaphore):
+  """Acquire a semaphore without counting the waiting time in the timeout
+  of the running coroutine
+
+  @param[asyncio.Semaphore] semaphore : the semaphore to acquire
+  """
+  clock = _clock.get()
+  if clock is not None:
+    clock.pause()
+  try:
+    await semaphore.acquire()
+  finally:
+    if clock is not None:
+      clock.resume()
+  try:
+    yield
+  finally:
+    semaphore.release()
+
+
+class AsyncRunner:
+  """Run coroutines concurrently on an event loop owned by a thread
+
+  The results are not handled by the loop thread, they are stacked and the
+  given wakeup function is called so the trigger serving thread can get them
+  by getResults()
+  """
+
+  def __init__(self, wakeup=None):
+    """Constructor : Build an idle runner, the loop is started on first use
+
+    @param[function] wakeup : function called without argument each time a
+                              coroutine has finished
+    """
+    self._wakeup = wakeup
+    self._loop = None
+    self._thread = None
+    self._lock = threading.Lock()
+    # list of (context, result, error) of finished coroutines
+    self._l_result = deque()
+    self._counter_pending = 0
+    self._event_idle = threading.Event()
+    self._event_idle.set()
+
+  def submit(self, coro, timeout, context=None):
+    """Schedule a coroutine on the loop
+
+    @param[coroutine] coro : the coroutine to run
+    @param[float] timeout : the maximum running time in seconds, the
+                            coroutine is cancelled after it. The time spent
+                            waiting in acquire() is not counted
+    @param[object] context : an object given back with the result
+    """
+    with self._lock:
+      if self._loop is None:
+        self._start()
+      self._counter_pending += 1
+      self._event_idle.clear()
+    future = asyncio.run_coroutine_threadsafe(self._run(coro, timeout),
+                                              self._loop)
+    future.add_done_callback(lambda f: self._done(f, context))
+
+  def getResults(self):
+    """Return the results of the finished coroutines since the last call
+
+    @return[list] : the list of (context, result, error) tuples, error is
+                    the raised exception or None
+    """
+    l_result = []
+    while self._l_result:
+      l_result.append(self._l_result.popleft())
+    return l_result
+
+  def getPending(self):
+    """Return the number of running coroutines
+    """
+    return self._counter_pending
+
+  def join(self, timeout=None):
+    """Wait until all running coroutines have finished
+
+    @param[float] timeout : the maximum time to wait
+    @return[boolean] : True if no coroutine is running anymore
+    """
+    return self._event_idle.wait(timeout)
+
+  def stop(self):
+    """Stop the loop and its thread
+    """
+    with self._lock:
+      if self._loop is None:
+        return
+      loop = self._loop
+      self._loop = None
+    loop.call_soon_threadsafe(loop.stop)
+    self._thread.join()
+    loop.close()
+
+  def _start(self):
+    """Create the event loop and its thread (the lock must be hold)
+    """
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever,
+                                    name='TRIGGER_ASYNC',
+                                    daemon=True)
+    self._thread.start()
+
+  @staticmethod
+  async def _run(coro, timeout):
+    """Run a coroutine with a timeout
+
+    @param[coroutine] coro : the coroutine to run
+    @param[float] timeout : the timeout in seconds, None for no timeout
+    @return[object] : the coroutine result
+    @raise[asyncio.TimeoutError] : if the coroutine has run too long
+    """
+    if timeout is None:
+      return await coro
+    clock = RunClock()
+    _clock.set(clock)
+    # the task copies the current context, so it sees the clock
+    task = asyncio.ensure_future(coro)
+    try:
+      while True:
+        remaining = timeout - clock.elapsed()
+        if remaining <= 0:
+          break
+        done, pending = await asyncio.wait([task], timeout=remaining)
+        if done:
+          return task.result()
+    finally:
+      if not task.done():
+        task.cancel()
+        try:
+          await task
+        except asyncio.CancelledError:
+          pass
+    if task.done() and not task.cancelled():
+      return task.result()
+    raise asyncio.TimeoutError()
+
+  def _done(self, future, context):
+    """Stack the result of a finished coroutine and wake up the serving thread
+
+    @param[concurrent.futures.Future] future : the finished future
+    @param[object] context : the context given to submit()
+    """
+    try:
+      self._l_result.append((context, future.result(), None))
+    except BaseException as e:
+      self._l_result.append((context, False, e))
+    with self._lock:
+      self._counter_pending -= 1
+      if self._counter_pending == 0:
+        self._event_idle.set()
+    if self._wakeup:
+      self._wakeup()
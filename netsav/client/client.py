@@ -28,7 +28,12 @@
 # System imports
 from http.client import HTTPConnection
 import logging
+import socket
 from threading import Thread
+import time
+
+# Projet Imports
+from ..status import StatusBoard
 
 # Global project declarations
 sys_log = logging.getLogger('netsav')
@@ -63,6 +68,11 @@ class Client(Thread):
     self.query_method = 'HEAD'
     # define if this client is a reference for internet accessibility
     self.is_ref = False
+    # comma separated list of groups of this client
+    self.group = ''
+    # number of seconds during which an inbound query from the host count
+    # as a successful observation, 0 to disable
+    self.passive = 0
 
     # Working value
     #  remaining time before next update
@@ -77,6 +87,36 @@ class Client(Thread):
     self.__state = self.UNKNOWN
     #  trigger object to use for handling event during update
     self.__trigger = None
+    #  status board on which publish the state
+    self.__status = None
+    #  time of the last state change and of the last query
+    self.__last_change = None
+    self.__last_check = None
+    #  duration in seconds of the last successful query
+    self.__latency = None
+    #  probe counters
+    self.__metrics = None
+    #  record of the queries received from the host
+    self.__inbound = None
+    self.__inbound_host = None
+    #  if the last observation was passive
+    self.__is_passive = False
+    #  the states view shared by the host in its last reply
+    self.__peer_view = None
+    #  assignment of the hosts to the cluster nodes
+    self.__sharding = None
+    #  if this node probe the host
+    self.__is_owner = True
+    #  the votes of the cluster nodes
+    self.__consensus = None
+    #  the election of the node which dispatch triggers
+    self.__election = None
+    #  the gossip which share the states dispatched by the other nodes
+    self.__gossip = None
+    #  the last state observed by this node
+    self.__observed = self.UNKNOWN
+    #  the last state sent to the trigger by this node
+    self.__dispatched = self.UNKNOWN
 
     Thread.__init__(self, name=__name__)
 
@@ -106,6 +146,10 @@ class Client(Thread):
         self.tcp_timeout = config['tcp_timeout']
       if 'query_method' in config:
         self.query_method = config['query_method']
+      if 'group' in config:
+        self.group = config['group']
+      if config.get('passive'):
+        self.passive = config['passive']
       if 'reference' in config:
         if config['reference'] == True:
           self.setReference()
@@ -135,14 +179,181 @@ class Client(Thread):
     """
     # init the remaining counter
     self.resetRemaining()
+    self.__watchInbound()
+    self.publishState()
     # loop until I'm in life
     while not self.__event_stop.isSet():
       # allow ref and active client to update their state
-      if self.is_ref or self.__event_active.isSet():
-        self.updateState(self.queryState())
+      if not self.isShardOwner():
+        self.followOwners()
+        self.dispatchState()
+        self.publishState()
+      elif self.is_ref or self.__event_active.isSet():
+        state = self.observeState()
+        if state is not None:
+          if self.__metrics is not None:
+            self.__metrics.observePassive()
+        else:
+          state = self.queryState()
+          if self.__metrics is not None:
+            if state == self.AVAILABLE:
+              self.__metrics.observe(self.__latency)
+            else:
+              self.__metrics.fail()
+        self.__observed = state
+        if self.__consensus is not None:
+          self.__consensus.observe(self.getName(), state)
+          state = self.__consensus.decide(self.getName(), state,
+                                          self.getState(), self.getVoters())
+        self.updateState(state)
+        self.publishState()
       # wait for the given time second by second
       self.__event_stop.wait(self.getRemaining())
 
+  def mayDispatch(self):
+    """Return True if this node must run the trigger of the host
+
+    In a cluster, the first owner of the host when hosts are sharded, else
+    the elected leader, is the only node which run the trigger
+    @return[boolean] : the permission
+    """
+    if self.__gossip is not None and not self.__gossip.isSettled():
+      # the other nodes are not known yet
+      allowed = False
+    elif self.__sharding is not None:
+      allowed = self.__sharding.isPrimary(self.getName())
+    elif self.__election is not None:
+      allowed = self.__election.isLeader()
+    else:
+      return True
+    if not allowed:
+      sys_log.debug('[' + self.getName() + '] trigger left to another node')
+    return allowed
+
+  def getDispatcher(self):
+    """Return the node which must run the trigger of the host
+
+    @return[string] : the node name
+                      None if no node is in charge
+    """
+    if self.__sharding is not None:
+      l_owner = self.__sharding.getOwners(self.getName())
+      if l_owner:
+        return l_owner[0]
+    elif self.__election is not None:
+      return self.__election.getLeader()
+    return None
+
+  def followDispatcher(self):
+    """Take the last state dispatched by the node in charge as dispatched
+
+    So when this node takes over, only the changes that this node has not
+    dispatched are run
+    """
+    node = self.getDispatcher()
+    if node is None or self.__gossip is None:
+      return
+    dispatched = self.__gossip.getDispatched(self.getName(), node)
+    if dispatched is not None:
+      self.__dispatched = dispatched
+
+  def isShardOwner(self):
+    """Return True if this node must probe the host
+
+    References are always probed, they check the uplink of this node
+    @return[boolean] : the ownership of the host
+    """
+    if self.__sharding is not None and not self.is_ref:
+      self.__is_owner = self.__sharding.isOwner(self.getName())
+    return self.__is_owner
+
+  def getVoters(self):
+    """Return the nodes whose observations of the host are counted
+
+    When hosts are sharded only the current owners vote, so a former owner
+    does not keep its vote after a rebalance
+    @return[list] : the node names
+                    None for all the alive nodes
+    """
+    if self.__sharding is None or self.is_ref:
+      return None
+    return self.__sharding.getOwners(self.getName())
+
+  def followOwners(self):
+    """Copy the state observed by the nodes which probe the host
+
+    The state is changed without running the trigger, the owners do it
+    """
+    state = self.__sharding.getOwnerState(self.getName())
+    if self.__consensus is not None:
+      state = self.__consensus.decide(self.getName(), state, self.getState(),
+                                      self.getVoters())
+    if state is not None and state != self.getState():
+      sys_log.debug('[' + self.getName() + '] owners see the host ' +
+                    Client.stateToString(state))
+      self.setState(state)
+      self.__last_change = time.time()
+
+  def observeState(self):
+    """Use a recent query received from the host as a successful observation
+
+    @return[int] : AVAILABLE if the host has queried the server recently
+                    None if the host must be queried
+    """
+    if self.__inbound_host is None:
+      return None
+    age = self.__inbound.getAge(self.__inbound_host)
+    if age is None or age > self.passive:
+      self.__is_passive = False
+      return None
+    sys_log.debug('[' + self.getName() + '] host has queried the server %.1fs ago',
+                  age)
+    self.__last_check = time.time()
+    self.__latency = None
+    self.__is_passive = True
+    return self.AVAILABLE
+
+  def readPeerView(self, response):
+    """Read the states view shared by the host in a reply
+
+    @param[http.client.HTTPResponse] response : the reply of the host
+    """
+    value = response.getheader(StatusBoard.STATE_HEADER)
+    if value is None:
+      return
+    view = StatusBoard.parseStateHeader(value)
+    if view is None:
+      sys_log.debug('[' + self.getName() + '] invalid state header')
+      return
+    node, version, d_state = view
+    self.__peer_view = {'node': node,
+                        'version': version,
+                        'states': d_state,
+                        'time': time.time()}
+
+  def getPeerView(self):
+    """Return the states view shared by the host in its last reply
+
+    @return[dict] : the 'node' hostname, the 'version' of its board, the
+                    'states' by client name and the 'time' of reception
+                    None if the host does not share its states
+    """
+    return self.__peer_view
+
+  def __watchInbound(self):
+    """Start the recording of queries received from the host address
+    """
+    if not (self.passive and self.__inbound):
+      return
+    try:
+      self.__inbound_host = socket.gethostbyname(self.address)
+    except OSError as e:
+      sys_log.warning('[' + self.getName() +
+                      '] unable to resolve address for passive observations: %s',
+                      e)
+      return
+    self.__inbound.watch(self.__inbound_host)
+
   def queryState(self):
     """Execute a request for retrieving the associated host's state
 
@@ -151,6 +362,8 @@ class Client(Thread):
     """
     c_retry = 0
     c_success = 0
+    self.__last_check = time.time()
+    self.__latency = None
 
     # Max retry is defined by config
     while c_retry < self.max_retry:
@@ -158,10 +371,13 @@ class Client(Thread):
       # if not the except block will be run
       h = HTTPConnection(self.address, self.port, timeout=self.tcp_timeout)
       try:
+        start = time.monotonic()
         # try to query
         status = h.request(self.query_method, '/')
         # parsing the result
         res = h.getresponse()
+        self.__latency = time.monotonic() - start
+        self.readPeerView(res)
         c_success += 1
         sys_log.debug('[' + self.getName() + '] get server code : %d',
                       res.status)
@@ -183,29 +399,80 @@ class Client(Thread):
     current = self.getState()
     if current != state:
       self.setState(state)
+      self.__last_change = time.time()
       sys_log.info('[' + self.getName() + '] Changing status to ' +
                    Client.stateToString(state))
-      # run the trigger event
-      if self.__trigger:
-        d = self.getConfigDict()
-        d['previous_state'] = current
-        d['previous_state_str'] = Client.stateToString(current)
-        # make the message event string
-        event = ('The network status of [' + d['name'] + '] at ' +
-                 d['address'] + ':' + d['port'] + ' change to ' +
-                 d['current_state_str'])
-
-        # call trigger
-        self.__trigger.trig(d,
-                            brief='Turn to ' + d['current_state_str'],
-                            msg=event,
-                            tag=d['name'])
       # Call sync function if this instance is a reference
       if self.is_ref:
         if state == self.AVAILABLE:
           self.__sync.referenceUp(self)
         elif state == self.UNAVAILABLE:
           self.__sync.referenceDown(self)
+    # run the trigger event, or the one left pending
+    self.dispatchState()
+
+  def dispatchState(self):
+    """Run the trigger if the state differs from the last dispatched one
+
+    In a cluster, a change seen while another node must run the trigger stays
+    pending until the node in charge shares that it has dispatched it. If
+    no node has, it is dispatched as soon as this node takes over, so a
+    change seen during a fail-over is not lost
+    """
+    if not self.__trigger or self.__dispatched == self.getState():
+      return
+    if not self.mayDispatch():
+      self.followDispatcher()
+      return
+    previous = self.__dispatched
+    self.__dispatched = self.getState()
+    d = self.getConfigDict()
+    d['previous_state'] = previous
+    d['previous_state_str'] = Client.stateToString(previous)
+    # make the message event string
+    event = ('The network status of [' + d['name'] + '] at ' +
+             d['address'] + ':' + d['port'] + ' change to ' +
+             d['current_state_str'])
+    brief = 'Turn to ' + d['current_state_str']
+    # the events of a reference are in the critical priority class
+    if self.is_ref:
+      stats = self.__sync.getStats()
+      event = ('The reference [' + d['name'] + '] at ' + d['address'] + ':' +
+               d['port'] + ' change to ' + d['current_state_str'] + ', ' +
+               str(stats['references_down']) + '/' +
+               str(stats['references']) + ' reference(s) down')
+      brief = 'Reference turn to ' + d['current_state_str']
+
+    # call trigger
+    self.__trigger.trig(d,
+                        brief=brief,
+                        msg=event,
+                        tag=d['name'])
+
+  def publishState(self):
+    """Publish the current state of this client on the status board
+
+    A new entry is built at each publication, so readers of the board never
+    see a partially updated entry
+    """
+    if self.__status is None:
+      return
+    entry = dict()
+    entry['address'] = self.address
+    entry['port'] = self.port
+    entry['group'] = self.group
+    entry['reference'] = self.is_ref
+    entry['state'] = self.getState()
+    entry['state_str'] = Client.stateToString(self.getState())
+    entry['last_change'] = self.__last_change
+    entry['last_check'] = self.__last_check
+    entry['latency'] = self.__latency
+    entry['passive'] = self.__is_passive
+    entry['peer_view'] = self.__peer_view
+    entry['owner'] = self.__is_owner
+    entry['observed'] = self.__observed
+    entry['dispatched'] = self.__dispatched
+    self.__status.publish(self.getName(), entry)
 
   def getName(self):
     """Return the internal name of this client object
@@ -251,13 +518,70 @@ class Client(Thread):
     """
     try:
       getattr(trigger, 'trig')
-      if not self.isReference():
-        self.__trigger = trigger
+      self.__trigger = trigger
     except AttributeError:
       self.__trigger = None
       sys_log.error('[' + self.getName() +
                     '] the given trigger does not contain trig function')
 
+  def setStatusBoard(self, status):
+    """Register the status board on which publish the state
+
+    @param(StatusBoard) : the status board instance to use
+    """
+    self.__status = status
+
+  def setSharding(self, sharding):
+    """Register the assignment of the hosts to the cluster nodes
+
+    @param(ProbeSharding) : the sharding to use, None to probe the host
+    """
+    self.__sharding = sharding
+
+  def setConsensus(self, consensus):
+    """Register the votes of the cluster nodes
+
+    @param(Consensus) : the consensus to use, None to decide alone
+    """
+    if not self.is_ref:
+      self.__consensus = consensus
+
+  def setElection(self, election):
+    """Register the election of the node which dispatch the triggers
+
+    @param(LeaderElection) : the election to use, None to always dispatch
+    """
+    self.__election = election
+
+  def setGossip(self, gossip):
+    """Register the gossip which share the states dispatched by the nodes
+
+    @param(Gossip) : the gossip to use, None outside a cluster
+    """
+    self.__gossip = gossip
+
+  def setInboundTracker(self, inbound):
+    """Register the record of queries received by the server
+
+    @param(InboundTracker) : the tracker to use for passive observations
+    """
+    self.__inbound = inbound
+
+  def setMetrics(self, metrics):
+    """Allocate the probe counters of this client in the metrics registry
+
+    @param(Metrics) : the metrics registry to use
+    """
+    self.__metrics = metrics.register(self.getName(), self.getState)
+
+  def getLatency(self):
+    """Return the duration of the last successful query
+
+    @return(float) : the duration in seconds
+                      None if the last query has failed
+    """
+    return self.__latency
+
   def resetRemaining(self):
     """Set the internal remaining time to his default value
 
@@ -291,8 +615,6 @@ class Client(Thread):
       return
     self.is_ref = True
     self.__sync.registerReference(self)
-    # disable the internal trigger, a reference host cannot trig event
-    self.__trigger = None
 
   def isReference(self):
     """Return the reference statement
@@ -315,6 +637,8 @@ class Client(Thread):
     c['min_retry'] = self.min_retry
     c['max_retry'] = self.max_retry
     c['tcp_timeout'] = self.tcp_timeout
+    c['group'] = self.group
+    c['reference'] = self.is_ref
     c['current_state'] = self.getState()
     c['current_state_str'] = Client.stateToString(self.getState())
     return c
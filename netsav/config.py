@@ -55,8 +55,10 @@ class NetsavConfigParser(ConfigParser):
   SERVER_SECTION = 'SERVER'
   DEFAULT_SECTION = 'DEFAULT'
   MAIN_SECTION = 'MAIN'
+  CLUSTER_SECTION = 'CLUSTER'
   TRIGGER_SECTION_REGEX = '^TRIGGER.*$'
-  IGNORE_SECTIONS = [SERVER_SECTION, DEFAULT_SECTION, MAIN_SECTION]
+  IGNORE_SECTIONS = [SERVER_SECTION, DEFAULT_SECTION, MAIN_SECTION,
+                     CLUSTER_SECTION]
 
   E_REG_IPV4 = '^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])(\/([0-9]|[12][0-9]|3[0-2]))?$'
 
@@ -95,6 +97,30 @@ class NetsavConfigParser(ConfigParser):
       return False
     return False
 
+  def check(self):
+    """Check the consistency of the loaded options
+
+    The features served by the main process cannot be used with responder
+    workers, because the workers cannot see the clients of the main process
+    @return(boolean) : True if options are consistent
+                        False otherwise
+    """
+    workers = self._getIntFromSection(self.SERVER_SECTION, 'workers', default=0)
+    if not workers:
+      return True
+    server = self.getServerConfigDict()
+    l_feature = [name for name in ['status', 'metrics', 'share_state']
+                 if server[name]]
+    if self.getClusterConfigDict()['peers']:
+      l_feature.append('[' + self.CLUSTER_SECTION + ']')
+    if any(c['passive'] for c in self.getClientConfigDict().values()):
+      l_feature.append('passive')
+    if l_feature:
+      sys_log.error("Incorrect option 'workers' read in configuration file, "
+                    "it cannot be used with : %s", ', '.join(l_feature))
+      return False
+    return True
+
   def isLoaded(self):
     """Return the load state of this config parser
 
@@ -216,6 +242,155 @@ class NetsavConfigParser(ConfigParser):
         self.SERVER_SECTION,
         'log_client',
         default=True)
+    conf['keepalive_timeout'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'keepalive_timeout',
+        default=5)
+    conf['keepalive_max'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'keepalive_max',
+        default=100)
+    conf['workers'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'workers',
+        default=0)
+    conf['rate'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'rate',
+        default=0)
+    conf['rate_burst'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'rate_burst',
+        default=10)
+    conf['max_connections'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'max_connections',
+        default=0)
+    conf['log_sample'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'log_sample',
+        default=1)
+    conf['log_aggregate'] = self._getIntFromSection(
+        self.SERVER_SECTION,
+        'log_aggregate',
+        default=0)
+    conf['status'] = self._getBooleanFromSection(
+        self.SERVER_SECTION,
+        'status',
+        default=False)
+    conf['metrics'] = self._getBooleanFromSection(
+        self.SERVER_SECTION,
+        'metrics',
+        default=False)
+    conf['share_state'] = self._getBooleanFromSection(
+        self.SERVER_SECTION,
+        'share_state',
+        default=False)
+    return conf
+
+  def getClusterConfigDict(self):
+    """Return the dict which contains the cluster parameters
+
+    @return(dict) : the parameters dict, 'peers' is empty if the cluster
+                    section is not defined
+    """
+    conf = dict()
+    conf['peers'] = []
+    if not self.has_section(self.CLUSTER_SECTION):
+      return conf
+    conf['name'] = self.get(self.CLUSTER_SECTION, 'name', fallback=None)
+    conf['peers'] = [p.strip() for p in self.get(self.CLUSTER_SECTION,
+                                                 'peers',
+                                                 fallback='').split(',')
+                     if p.strip()]
+    conf['gossip_interval'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'gossip_interval',
+        default=5)
+    conf['gossip_fanout'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'gossip_fanout',
+        default=2)
+    conf['node_timeout'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'node_timeout',
+        default=30)
+    conf['replicas'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'replicas',
+        default=0)
+    conf['quorum'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'quorum',
+        default=0)
+    # only the owners of a sharded host vote
+    if (conf['replicas'] and conf['quorum'] and
+        conf['quorum'] > conf['replicas']):
+      sys_log.error("Incorrect quorum %d read in configuration file, "
+                    "it must be at most replicas (%d)",
+                    conf['quorum'], conf['replicas'])
+      conf['quorum'] = conf['replicas']
+    conf['election'] = self._getBooleanFromSection(
+        self.CLUSTER_SECTION,
+        'election',
+        default=False)
+    conf['lease_duration'] = self._getIntFromSection(
+        self.CLUSTER_SECTION,
+        'lease_duration',
+        default=10)
+    return conf
+
+  def getTriggerLoaderConfigDict(self):
+    """Return the dict which contains the trigger loader parameters
+
+    These parameters are read in the main section with the 'trigger_' prefix
+    @return(dict) : the parameters dict
+    """
+    conf = dict()
+    conf['journal'] = self.get(self.MAIN_SECTION,
+                               'trigger_journal',
+                               fallback=None)
+    conf['journal_sync'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_journal_sync',
+        default=1)
+    conf['journal_compact'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_journal_compact',
+        default=1000)
+    conf['queue_size'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_queue_size',
+        default=1000)
+    conf['queue_policy'] = self.get(self.MAIN_SECTION,
+                                    'trigger_queue_policy',
+                                    fallback='drop_oldest')
+    conf['priority'] = self.get(self.MAIN_SECTION,
+                                'trigger_priority',
+                                fallback='critical,down,up,info')
+    conf['priority_aging'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_priority_aging',
+        default=30)
+    conf['dedup'] = self._getBooleanFromSection(
+        self.MAIN_SECTION,
+        'trigger_dedup',
+        default=False)
+    conf['rate'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_rate',
+        default=0)
+    conf['rate_burst'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_rate_burst',
+        default=5)
+    conf['dead_letter'] = self.get(self.MAIN_SECTION,
+                                   'trigger_dead_letter',
+                                   fallback=None)
+    conf['dead_letter_size'] = self._getIntFromSection(
+        self.MAIN_SECTION,
+        'trigger_dead_letter_size',
+        default=100)
     return conf
 
   def getTriggerConfigDict(self, section):
@@ -264,6 +439,12 @@ class NetsavConfigParser(ConfigParser):
         c_conf['query_method'] = self.get(client_section,
                                           'query_method',
                                           fallback='HEAD')
+        c_conf['group'] = self.get(client_section,
+                                   'group',
+                                   fallback='')
+        c_conf['passive'] = self._getIntFromSection(client_section,
+                                                    'passive',
+                                                    default=0)
         c_conf['reference'] = self._getBooleanFromSection(
             client_section,
             'reference',
@@ -0,0 +1,115 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/consensus module
+
+It provide the multi-vantage decision of the hosts availability, a host is
+declared unavailable only when enough nodes observe it down
+"""
+
+# System imports
+import threading
+
+# Projet Imports
+
+
+class Consensus:
+  """Count the nodes which observe each host down
+
+  The observations are given one by one, by the local clients and by the
+  gossip when it receives a new state, and only the set of nodes which see
+  the host down is updated, so a decision never needs to look at all the
+  observations. Only the votes of the alive nodes are counted, a node which
+  stops does not keep its last vote
+  """
+
+  # the state values, they are the same as the Client ones
+  UNAVAILABLE = 0
+  AVAILABLE = 1
+
+  def __init__(self, gossip, quorum):
+    """Constructor : Build an empty vote
+
+    @param[Gossip] gossip : the gossip instance which know the node name
+                            and the alive nodes
+    @param[int] quorum : the number of nodes which must observe a host down
+                          to declare it unavailable
+    """
+    self.__gossip = gossip
+    self.node = gossip.node
+    self.quorum = max(1, quorum)
+    self._lock = threading.Lock()
+    # client name => set of nodes which observe the host down
+    self._d_down = dict()
+
+  def observe(self, name, state, node=None):
+    """Record the observation of a host by a node
+
+    @param[string] name : the client name
+    @param[int] state : the observed state, None to forget the observation
+    @param[string] node : the observing node, None for this node
+    """
+    if node is None:
+      node = self.node
+    with self._lock:
+      s_down = self._d_down.setdefault(name, set())
+      if state == self.UNAVAILABLE:
+        s_down.add(node)
+      else:
+        s_down.discard(node)
+
+  def getDownCount(self, name, l_voter=None):
+    """Return the number of voting nodes which observe a host down
+
+    @param[string] name : the client name
+    @param[list] l_voter : the nodes whose votes are counted,
+                            None for all the alive nodes
+    @return[int] : the number of nodes
+    """
+    if l_voter is None:
+      l_voter = self.__gossip.getAliveNodes()
+    with self._lock:
+      s_down = self._d_down.get(name)
+      if not s_down:
+        return 0
+      return len(s_down.intersection(l_voter))
+
+  def decide(self, name, observed, current, l_voter=None):
+    """Return the state of a host according to the votes
+
+    The host is unavailable when the quorum observe it down. If the local
+    observation is down but the quorum is not reached, the current state is
+    kept because the uplink of this node may be the failing one
+    @param[string] name : the client name
+    @param[int] observed : the state observed by this node
+    @param[int] current : the current state of the host
+    @param[list] l_voter : the nodes whose votes are counted, as the owners
+                            of a sharded host, None for all the alive nodes
+    @return[int] : the decided state
+    """
+    if self.getDownCount(name, l_voter) >= self.quorum:
+      return self.UNAVAILABLE
+    if observed == self.UNAVAILABLE or observed is None:
+      return current
+    return observed
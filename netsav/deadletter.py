@@ -0,0 +1,99 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/deadletter module
+
+It provide a store for trigger events which have failed after all their retry
+"""
+
+# System imports
+from collections import deque
+import json
+import logging
+import threading
+import time
+
+# Projet Imports
+
+# Global project declarations
+sys_log = logging.getLogger('netsav')
+
+
+class DeadLetterStore:
+  """Keep the events that a trigger has not been able to handle
+
+  The last events are kept in memory to be inspected by netsav, and all
+  of them can be appended to a file as json lines to be inspected by hand
+  """
+
+  def __init__(self, path=None, size=100):
+    """Constructor : Build a dead letter store
+
+    @param[string] path : the path of the file in which append the events
+                          None to keep them only in memory
+    @param[int] size : the number of events kept in memory
+    """
+    self.path = path
+    self._lock = threading.Lock()
+    self._l_letter = deque(maxlen=size)
+    self._counter = 0
+
+  def add(self, name, value, attempts):
+    """Store an event which has failed
+
+    @param[string] name : the name of the trigger which has failed
+    @param[dict] value : the event value
+    @param[int] attempts : the number of attempts made
+    """
+    letter = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'trigger': name,
+              'attempts': attempts,
+              'event': value}
+    with self._lock:
+      self._l_letter.append(letter)
+      self._counter += 1
+    if self.path is None:
+      return
+    try:
+      with open(self.path, 'a') as f:
+        f.write(json.dumps(letter, default=str) + '\n')
+    except OSError as e:
+      sys_log.error('[TRIGGER] Unable to write dead letter into ' + self.path +
+                    ': ' + str(e))
+
+  def getLetters(self):
+    """Return the events kept in memory
+
+    @return[list] : the list of dead letter dict, with 'time', 'trigger',
+                    'attempts' and 'event' keys, the oldest first
+    """
+    with self._lock:
+      return list(self._l_letter)
+
+  def getCounter(self):
+    """Return the total number of dead letters
+
+    @return[int] : the counter
+    """
+    return self._counter
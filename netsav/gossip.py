@@ -0,0 +1,341 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/gossip module
+
+It provide the gossip protocol by which netsav nodes share the states
+observed by their clients
+"""
+
+# System imports
+from http.client import HTTPConnection, HTTPException
+import json
+import logging
+import random
+import socket
+import threading
+from threading import Thread
+import time
+from urllib.parse import parse_qs, quote, unquote
+
+# Projet Imports
+
+# Global project declarations
+sys_log = logging.getLogger('netsav')
+
+
+class Gossip(Thread):
+  """Share the client states with the other nodes of the cluster
+
+  Each node number its own state changes with a sequence. The version vector
+  of a node contains, for each origin node, the generation and the last
+  sequence it knows. At each round, a node send its vector to a few random
+  peers on their server, and they answer only the entries that the vector
+  does not cover, so only deltas are exchanged. The generation is the start
+  time of the origin, so the entries of a restarted node replace the old ones
+  """
+
+  # path of the gossip endpoint on the server
+  PATH = '/gossip'
+
+  def __init__(self, event, status):
+    """Constructor : Build a gossip thread
+
+    @param[threading.Event] event : the event object which define
+                                    this tread life state
+    @param[StatusBoard] status : the board from which read the local states
+    """
+    self.__event_stop = event
+    self.__status = status
+
+    # name of this node in the cluster
+    self.node = socket.gethostname()
+    # list of (address, port) of the other nodes servers
+    self.l_peer = []
+    # number of seconds between two rounds
+    self.interval = 5
+    # number of peers contacted at each round
+    self.fanout = 2
+    self.tcp_timeout = 2
+    # number of seconds after which a silent node is considered as dead
+    self.node_timeout = 30
+
+    self._lock = threading.Lock()
+    self._generation = int(time.time())
+    self._start = time.monotonic()
+    self._seq = 0
+    # the last (state, dispatched state) of each local client that has been
+    # numbered
+    self._d_local = dict()
+    # (origin, client) => (generation, seq, state, time, dispatched state)
+    self._d_entry = dict()
+    # origin => (generation, seq)
+    self._d_vector = dict()
+    # origin => (generation, counter) and monotonic time of the last increase
+    self._heartbeat = 0
+    self._d_heartbeat = dict()
+    self._d_seen = dict()
+    # names of the configured peers, learnt from their answers
+    self._s_peer_node = set()
+    # function called with (origin, client, state) for each new observation
+    self._listener = None
+    Thread.__init__(self, name='GOSSIP')
+
+  def load(self, config):
+    """Load gossip configuration
+
+    @param[dict] config : the cluster configuration dict
+    @return[boolean] : True if load success
+                      False otherwise
+    """
+    if config.get('name'):
+      self.node = config['name']
+    for peer in config.get('peers', []):
+      address, _, port = peer.rpartition(':')
+      try:
+        self.l_peer.append((address, int(port)))
+      except ValueError:
+        sys_log.error("Invalid gossip peer '%s'", peer)
+        return False
+    if config.get('gossip_interval'):
+      self.interval = config['gossip_interval']
+    if config.get('gossip_fanout'):
+      self.fanout = config['gossip_fanout']
+    if config.get('node_timeout'):
+      self.node_timeout = config['node_timeout']
+    return len(self.l_peer) > 0
+
+  def setListener(self, func):
+    """Define a function called for each observation received from a node
+
+    @param[function] func : function called with the origin node, the client
+                            name and the state, or None when the observation
+                            is forgotten, it must not call this instance
+    """
+    self._listener = func
+
+  def run(self):
+    """Run the thread
+    """
+    while not self.__event_stop.isSet():
+      self.publishLocal()
+      with self._lock:
+        self._heartbeat += 1
+      for peer in random.sample(self.l_peer, min(self.fanout, len(self.l_peer))):
+        self.__pull(peer)
+      self.__event_stop.wait(self.interval)
+
+  def publishLocal(self):
+    """Number the local client states which have changed since last time
+    """
+    d_entry = self.__status.getEntries()
+    with self._lock:
+      for name, entry in d_entry.items():
+        # the states copied from the owners of a host are not observations
+        if not entry.get('owner', True):
+          continue
+        # share what the client has seen, not the decided state, and the
+        # last state sent to the trigger
+        state = entry.get('observed', entry['state'])
+        dispatched = entry.get('dispatched')
+        if self._d_local.get(name) == (state, dispatched):
+          continue
+        self._seq += 1
+        self._d_local[name] = (state, dispatched)
+        self._d_entry[(self.node, name)] = (self._generation, self._seq,
+                                            state,
+                                            entry['last_change'] or time.time(),
+                                            dispatched)
+        self._d_vector[self.node] = (self._generation, self._seq)
+
+  def __pull(self, peer):
+    """Ask a peer the entries that this node does not know
+
+    @param[tuple] peer : the (address, port) of the peer server
+    """
+    with self._lock:
+      vector = ','.join(quote(origin, safe='') + ':' + str(g) + '.' + str(s)
+                        for origin, (g, s) in self._d_vector.items())
+      heartbeat = str(self._generation) + '.' + str(self._heartbeat)
+    path = (self.PATH + '?n=' + quote(self.node, safe='') + '&h=' + heartbeat
+            + '&v=' + quote(vector))
+    h = HTTPConnection(peer[0], peer[1], timeout=self.tcp_timeout)
+    try:
+      h.request('GET', path)
+      res = h.getresponse()
+      if res.status != 200:
+        sys_log.debug('[GOSSIP] peer %s:%d answer code %d', peer[0], peer[1],
+                      res.status)
+        return
+      self.merge(json.loads(res.read().decode('utf-8')))
+    except (OSError, HTTPException, ValueError, KeyError, TypeError) as e:
+      sys_log.debug('[GOSSIP] unable to pull from %s:%d : %s', peer[0],
+                    peer[1], e)
+    finally:
+      h.close()
+
+  def getDelta(self, query):
+    """Return the entries that a version vector does not cover
+
+    This is the body function of the gossip endpoint
+    @param[string] query : the request query string which contains the
+                            vector in the 'v' parameter, the requesting node
+                            name and heartbeat in 'n' and 'h'
+    @return[bytes] : the JSON document
+    """
+    d_query = parse_qs(query)
+    d_known = dict()
+    for item in d_query.get('v', [''])[0].split(','):
+      try:
+        origin, version = item.rsplit(':', 1)
+        g, s = version.split('.')
+        d_known[unquote(origin)] = (int(g), int(s))
+      except ValueError:
+        continue
+    with self._lock:
+      # the request is a heartbeat of the requesting node
+      try:
+        g, c = d_query['h'][0].split('.')
+        self.__updateHeartbeat(d_query['n'][0], (int(g), int(c)))
+      except (KeyError, ValueError):
+        pass
+      l_entry = []
+      for (origin, name), entry in self._d_entry.items():
+        if entry[:2] > d_known.get(origin, (0, 0)):
+          l_entry.append([origin, name] + list(entry))
+      d_heartbeat = dict(self._d_heartbeat)
+      d_heartbeat[self.node] = (self._generation, self._heartbeat)
+      doc = {'node': self.node,
+             'vector': self._d_vector,
+             'heartbeat': d_heartbeat,
+             'entries': l_entry}
+      return json.dumps(doc).encode('utf-8')
+
+  def merge(self, doc):
+    """Merge the entries answered by a peer
+
+    @param[dict] doc : the decoded gossip document
+    """
+    with self._lock:
+      # the document is the answer of a configured peer
+      self._s_peer_node.add(doc['node'])
+      for origin, (g, s) in doc['vector'].items():
+        if origin == self.node:
+          continue
+        known = self._d_vector.get(origin, (0, 0))
+        if g > known[0]:
+          # the origin has restarted, forget its old entries
+          for key in [k for k in self._d_entry if k[0] == origin]:
+            del self._d_entry[key]
+            if self._listener:
+              self._listener(origin, key[1], None)
+        if (g, s) > known:
+          self._d_vector[origin] = (g, s)
+      for origin, name, g, s, state, t, dispatched in doc['entries']:
+        if origin == self.node:
+          continue
+        current = self._d_entry.get((origin, name))
+        if g >= self._d_vector.get(origin, (0, 0))[0] and (
+            current is None or (g, s) > current[:2]):
+          self._d_entry[(origin, name)] = (g, s, state, t, dispatched)
+          if self._listener and (current is None or current[2] != state):
+            self._listener(origin, name, state)
+      for origin, (g, c) in doc['heartbeat'].items():
+        self.__updateHeartbeat(origin, (g, c))
+
+  def __updateHeartbeat(self, origin, heartbeat):
+    """Record the heartbeat of a node if it has increased (the lock must be hold)
+
+    Only the heartbeats of the configured peers are recorded, so anyone who
+    can query the server cannot add a node to the cluster
+    @param[string] origin : the node name
+    @param[tuple] heartbeat : the generation and the counter of the node
+    """
+    if origin == self.node or origin not in self._s_peer_node:
+      return
+    if heartbeat > self._d_heartbeat.get(origin, (0, -1)):
+      self._d_heartbeat[origin] = heartbeat
+      self._d_seen[origin] = time.monotonic()
+
+  def getTable(self):
+    """Return the cluster-wide state table
+
+    @return[dict] : for each client name, the dict of state by node
+    """
+    d_table = dict()
+    with self._lock:
+      for (origin, name), entry in self._d_entry.items():
+        d_table.setdefault(name, dict())[origin] = entry[2]
+    return d_table
+
+  def getObservations(self, name):
+    """Return the states of a client observed by each node
+
+    @param[string] name : the client name
+    @return[dict] : the (state, time of change) by node name
+    """
+    d_observation = dict()
+    with self._lock:
+      for (origin, client), entry in self._d_entry.items():
+        if client == name:
+          d_observation[origin] = (entry[2], entry[3])
+    return d_observation
+
+  def getDispatched(self, name, node):
+    """Return the last state of a client sent to the trigger by a node
+
+    @param[string] name : the client name
+    @param[string] node : the node name
+    @return[int] : the state
+                   None if the node has not shared it
+    """
+    with self._lock:
+      entry = self._d_entry.get((node, name))
+    if entry is None:
+      return None
+    return entry[4]
+
+  def isSettled(self):
+    """Return True if this node knows the alive nodes of the cluster
+
+    All peers have answered once, or a node timeout has elapsed since this
+    node has started, so a dead peer cannot delay it forever
+    @return[boolean]
+    """
+    if time.monotonic() - self._start >= self.node_timeout:
+      return True
+    with self._lock:
+      return len(self._s_peer_node) >= len(self.l_peer)
+
+  def getAliveNodes(self):
+    """Return the nodes whose heartbeat has increased recently
+
+    @return[list] : the sorted list of node names, including this node
+    """
+    now = time.monotonic()
+    with self._lock:
+      l_node = [origin for origin, seen in self._d_seen.items()
+                if now - seen <= self.node_timeout]
+    l_node.append(self.node)
+    return sorted(set(l_node))
@@ -25,4 +25,4 @@
 """HttpTeepotReply/httpteepotreply package initializer
 """
 
-__all__ = ['httpteepotreply']
\ No newline at end of file
+__all__ = ['httpteepotreply', 'accesslog']
\ No newline at end of file
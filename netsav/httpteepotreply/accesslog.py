@@ -0,0 +1,140 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of HttpTeepotReply
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Access log module of HttpTeepotReply
+
+The requests are only put in a queue by the server, the log messages are
+emitted by a background thread so the request handling never wait for the
+logging backend
+"""
+
+# System imports
+import queue
+import threading
+import time
+
+
+class AccessLog:
+  """Queue backed access logger
+
+  Each query can be logged, or only one query over 'sample'. The queries can
+  also be counted by source host and reported every 'aggregate' seconds
+  """
+
+  # maximum number of queries waiting in the queue, next ones are dropped
+  QUEUE_SIZE = 10000
+
+  def __init__(self, logger, sample = 1, aggregate = 0):
+    """Constructor : Build an idle access log, its thread is started on first use
+
+    @param(logging.logger) logger : the logger in which emit messages
+    @param(int) sample : log one query over this number, 0 disable the
+                          message of each query
+    @param(int) aggregate : interval in seconds of the per host summary,
+                            0 disable the summary
+    """
+    self._logger = logger
+    self._sample = max(0, int(sample))
+    self._aggregate = max(0, int(aggregate))
+    self._queue = queue.Queue(self.QUEUE_SIZE)
+    self._thread = None
+    # number of queries dropped because the queue was full
+    self._counter_dropped = 0
+
+  def record(self, command, address):
+    """Put a query in the log queue
+
+    @param(string) command : the request method
+    @param(tuple) address : the client address
+    """
+    if self._thread is None:
+      self._start()
+    try:
+      self._queue.put_nowait((command, address))
+    except queue.Full:
+      self._counter_dropped += 1
+
+  def close(self):
+    """Log all queued queries and stop the thread
+    """
+    if self._thread is None:
+      return
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+
+  def _start(self):
+    """Start the logging thread
+    """
+    self._thread = threading.Thread(target=self._run, name='ACCESS_LOG')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self):
+    """Main loop of the logging thread
+    """
+    d_count = dict()
+    counter = 0
+    last_report = time.monotonic()
+    timeout = self._aggregate or None
+    while True:
+      try:
+        item = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        item = False
+      if item:
+        command, address = item
+        counter += 1
+        if self._sample and counter % self._sample == 0:
+          self._logger.info('Receive a %s query from host %s:%s',
+                            command, address[0], address[1])
+        if self._aggregate:
+          d_count[address[0]] = d_count.get(address[0], 0) + 1
+      now = time.monotonic()
+      if self._aggregate and (item is None or now - last_report >= self._aggregate):
+        self._report(d_count, now - last_report)
+        d_count = dict()
+        last_report = now
+      elif not self._aggregate and self._queue.empty():
+        self._reportDropped()
+      if item is None:
+        return
+
+  def _report(self, d_count, elapsed):
+    """Emit the per host summary
+
+    @param(dict) d_count : the number of queries by host
+    @param(float) elapsed : the number of seconds covered by the summary
+    """
+    for host in sorted(d_count):
+      self._logger.info('Receive %d queries from host %s in the last %d s',
+                        d_count[host], host, elapsed)
+    self._reportDropped()
+
+  def _reportDropped(self):
+    """Emit a warning if some queries have been dropped from the queue
+    """
+    dropped, self._counter_dropped = self._counter_dropped, 0
+    if dropped:
+      self._logger.warning('%d queries have not been logged', dropped)
@@ -24,20 +24,32 @@
 
 """Main HttpTeepotReply module, contains main Class
 
+Other paths than the teepot can be answered by functions registered with
+self.setRoute()
 If you use self.server_forever() the server will handle indefinitly client request
+until self.shutdown() is called. All connections are handled by a single
+non-blocking event loop, and shutdown() wake it up through a pipe
+Connections are persistent (HTTP/1.1 keep-alive) and pipelined requests are
+answered in order, until the idle timeout or the maximum number of requests
+per connection is reached
 Else is you use self.handle_request() the server will handle request until timeout (defined by self.timeout=X) is reached, then it will run the handle_timeout and return
 """
 
 # System imports
+import io
 import logging
 import logging.handlers
 import os
 import re
+import selectors
 import socket
 import sys
+import time
 
 # Projet Imports
+from email.utils import formatdate
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from .accesslog import AccessLog
 
 class HttpTeepotReply(HTTPServer):
   """(extend HTTPServer) Run a simple http server
@@ -48,12 +60,46 @@ class HttpTeepotReply(HTTPServer):
   port => 'the port on which listen'
   """
   
+  # listen backlog, the event loop accept connections by bursts
+  request_queue_size = socket.SOMAXCONN
+  # maximum size of a request head in bytes
+  MAX_REQUEST_SIZE = 8192
+  # number of seconds after which an inactive connection is closed
+  CONNECTION_TIMEOUT = 10
+  # size of socket reads
+  RECV_SIZE = 4096
+  # methods answered directly with the pre-encoded response
+  FAST_METHODS = frozenset([b'HEAD', b'GET', b'POST'])
+  # the constant part of the response, the Date header is appended to it
+  RESPONSE_HEAD = (b'HTTP/1.1 418 I\'m a teepot\r\n'
+                    + b'Content-type: text/plain\r\n'
+                    + b'Content-Length: 0\r\n')
+  # the connection header of the response, by keep-alive state
+  CONNECTION_HEADER = {True: b'Connection: keep-alive\r\n',
+                        False: b'Connection: close\r\n'}
+  # the responses sent to rejected clients
+  RESPONSE_RATE_LIMITED = (b'HTTP/1.1 429 Too Many Requests\r\n'
+                            + b'Content-Length: 0\r\n'
+                            + b'Connection: close\r\n\r\n')
+  RESPONSE_OVERLOADED = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                          + b'Content-Length: 0\r\n'
+                          + b'Connection: close\r\n\r\n')
+  # number of seconds between two cleanups of the rate limiter
+  PRUNE_INTERVAL = 60
+
   IPV4_REGEX = '^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$'
   DN_REGEX = '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
   
   def __init__(self, address = '0.0.0.0', port = None, logger = None, 
                               bind_and_activate = True,
-                              log_client = True):
+                              log_client = True,
+                              keepalive_timeout = 5,
+                              keepalive_max = 100,
+                              reuse_port = False,
+                              limiter = None,
+                              max_connections = 0,
+                              log_sample = 1,
+                              log_aggregate = 0):
     """Constructor : Build an http teepot reply server
     
     @param(string) address : the address on which the server socket will listen
@@ -63,6 +109,25 @@ class HttpTeepotReply(HTTPServer):
     @param(boolean) bind_and_activate : define bind_and_activate option see 
                                           socketserver.TCPServer
     @param(boolean) log_client : print a log entry for each client who make a query to this server
+    @param(int) keepalive_timeout : number of seconds after which an idle
+                                    persistent connection is closed,
+                                    0 disable persistent connections
+    @param(int) keepalive_max : maximum number of requests answered on a
+                                single connection
+    @param(boolean) reuse_port : set SO_REUSEPORT on the listening socket, so
+                                  several servers can listen on the same port
+                                  and the kernel balance connections between
+                                  them
+    @param(object) limiter : an optional rate limiter which provide
+                              allow(key) and prune() functions, each request
+                              consume a token of its source address
+    @param(int) max_connections : maximum number of simultaneous connections,
+                                  0 for no limit
+    @param(int) log_sample : with log_client, log one query over this number,
+                              0 log only the summary
+    @param(int) log_aggregate : with log_client, log every this number of
+                                seconds the number of queries of each host,
+                                0 disable the summary
     """
     # Get logger
     if logger is None:
@@ -70,6 +135,15 @@ class HttpTeepotReply(HTTPServer):
     else:
       self._logger = logger
     self._if_log_client = log_client
+    self._observer = None
+    self._access_log = None
+    if log_client:
+      self._access_log = AccessLog(self._logger, log_sample, log_aggregate)
+    self._keepalive_timeout = max(0, int(keepalive_timeout))
+    self._keepalive_max = max(1, int(keepalive_max))
+    self._reuse_port = reuse_port
+    self._limiter = limiter
+    self._max_connections = max(0, int(max_connections))
     # Get port
     if port:
       try:
@@ -97,11 +171,42 @@ class HttpTeepotReply(HTTPServer):
     self._h_class = None
     self._h_func = None
     self._h_obj = None
+    # event loop state
+    self._selector = None
+    self._is_stopping = False
+    self._d_conn = dict()
+    self._last_expire = 0
+    self._last_prune = time.monotonic()
+    # number of answered requests, of rejected requests and connections
+    self._counter_request = 0
+    self._counter_rate_limited = 0
+    self._counter_overloaded = 0
+    # the pre-encoded responses by keep-alive state
+    # and the second at which they were built
+    self._d_response = dict()
+    self._response_time = None
+    self._date = None
+    # the function which return additional header lines of the teepot reply
+    self._header_provider = None
+    self._header = b''
+    # the functions which build the body of the other paths
+    self._d_route = dict()
+    # the pipe used to wake up the event loop
+    self._wakeup_r, self._wakeup_w = os.pipe()
+    os.set_blocking(self._wakeup_r, False)
+    os.set_blocking(self._wakeup_w, False)
 
     HTTPServer.__init__(self, (self._address, self._port),
                         HttpReplyHandler,
                         bind_and_activate)
 
+  def server_bind(self):
+    """(override)Bind the listening socket, sharing its port if asked
+    """
+    if self._reuse_port:
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    HTTPServer.server_bind(self)
+
   def serve_forever(self):
     """Handle incoming request forever
     """
@@ -114,10 +219,460 @@ class HttpTeepotReply(HTTPServer):
                         +':'
                         +str(self._port))
     try:
-      HTTPServer.serve_forever(self)
+      self.serve()
     except (KeyboardInterrupt, SystemExit):
       self._logger.error('## Abnormal termination ##')
-    
+
+  def serve(self):
+    """Run the event loop until shutdown() is called
+
+    The listening socket, all client connections and the wakeup pipe are
+    watched by the same selector, so many connections can be handled
+    concurrently without any thread
+    """
+    self.socket.setblocking(False)
+    self._selector = selectors.DefaultSelector()
+    self._selector.register(self.socket, selectors.EVENT_READ, self._accept)
+    self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+    try:
+      while not self._is_stopping:
+        for key, mask in self._selector.select(self._getSelectTimeout()):
+          if key.data is None:
+            self._drainWakeup()
+          else:
+            key.data(key.fileobj, mask)
+        self._expire()
+    finally:
+      for conn in list(self._d_conn.values()):
+        self._closeConnection(conn)
+      self._selector.close()
+      self._selector = None
+
+  def shutdown(self):
+    """Stop the event loop, can be called from any thread or signal handler
+    """
+    self._is_stopping = True
+    if self._wakeup_w is None:
+      # the server is already closed, its file descriptors may now belong
+      # to another object of the process
+      return
+    try:
+      os.write(self._wakeup_w, b'\0')
+    except OSError:
+      # the pipe is full, the loop will wake up anyway
+      pass
+
+  def server_close(self):
+    """Close the listening socket and the wakeup pipe
+
+    Calling this function more than once has no effect
+    """
+    if self._wakeup_r is None:
+      return
+    HTTPServer.server_close(self)
+    if self._access_log:
+      self._access_log.close()
+    for fd in [self._wakeup_r, self._wakeup_w]:
+      try:
+        os.close(fd)
+      except OSError:
+        pass
+    self._wakeup_r = self._wakeup_w = None
+
+  def isClosed(self):
+    """Return True if server_close() has already been called
+
+    @return(boolean)
+    """
+    return self._wakeup_r is None
+
+  def finish_request(self, request, client_address):
+    """(override)Answer a blocking connection accepted by handle_request()
+
+    @param(socket) request : the client socket
+    @param(tuple) client_address : the client address
+    """
+    request.settimeout(self.CONNECTION_TIMEOUT)
+    data = b''
+    while b'\r\n\r\n' not in data and len(data) <= self.MAX_REQUEST_SIZE:
+      chunk = request.recv(self.RECV_SIZE)
+      if not chunk:
+        break
+      data += chunk
+    request.sendall(self._handle(data, client_address, False)[0])
+
+  def _drainWakeup(self):
+    """Read all pending bytes of the wakeup pipe
+    """
+    try:
+      while os.read(self._wakeup_r, 512):
+        pass
+    except OSError:
+      pass
+
+  def _getSelectTimeout(self):
+    """Return the time to wait for a network event
+
+    @return(float) : the number of seconds before the next connection expire
+                      None if there is no connection
+    """
+    if not self._d_conn:
+      return None
+    return 1.0
+
+  def _accept(self, sock, mask):
+    """Accept all pending connections on the listening socket
+
+    @param(socket) sock : the listening socket
+    @param(int) mask : the selector event mask
+    """
+    while True:
+      try:
+        client, address = sock.accept()
+      except (BlockingIOError, InterruptedError):
+        return
+      except OSError as e:
+        self._logger.error('Unable to accept connection: %s', e)
+        return
+      if self._max_connections and len(self._d_conn) >= self._max_connections:
+        self._reject(client, self.RESPONSE_OVERLOADED)
+        self._counter_overloaded += 1
+        continue
+      client.setblocking(False)
+      conn = ReplyConnection(client, address)
+      self._d_conn[client.fileno()] = conn
+      self._selector.register(client, selectors.EVENT_READ, self._serveConnection)
+
+  def _serveConnection(self, sock, mask):
+    """Handle a readable or writable client connection
+
+    @param(socket) sock : the client socket
+    @param(int) mask : the selector event mask
+    """
+    conn = self._d_conn.get(sock.fileno())
+    if conn is None:
+      return
+    if mask & selectors.EVENT_READ:
+      self._read(conn)
+    if conn.sock is not None and mask & selectors.EVENT_WRITE:
+      self._write(conn)
+
+  def _read(self, conn):
+    """Read available data of a connection and answer complete requests
+
+    @param(ReplyConnection) conn : the client connection
+    """
+    try:
+      data = conn.sock.recv(self.RECV_SIZE)
+    except (BlockingIOError, InterruptedError):
+      return
+    except OSError:
+      self._closeConnection(conn)
+      return
+    if not data:
+      self._closeConnection(conn)
+      return
+    conn.last_activity = time.monotonic()
+    conn.inbuf += data
+    if conn.close_after_write:
+      # ignore all data after the request
+      conn.inbuf = b''
+      return
+
+    # answer all complete requests in the order they were sent
+    while conn.inbuf and not conn.close_after_write:
+      request = self._popRequest(conn)
+      if request is None:
+        break
+      conn.requests += 1
+      self._counter_request += 1
+      if self._limiter and not self._limiter.allow(conn.address[0]):
+        self._counter_rate_limited += 1
+        response, keep_alive = self.RESPONSE_RATE_LIMITED, False
+      else:
+        keep_alive = (self._keepalive_timeout > 0
+                      and conn.requests < self._keepalive_max)
+        response, keep_alive = self._handle(request, conn.address, keep_alive)
+      conn.outbuf += response
+      if not keep_alive:
+        conn.close_after_write = True
+        conn.inbuf = b''
+    if conn.sock is not None:
+      self._write(conn)
+
+  def _reject(self, sock, response):
+    """Send a short response to a client socket and close it
+
+    The response is sent in a single attempt, without waiting for the client
+    @param(socket) sock : the client socket
+    @param(bytes) response : the raw response
+    """
+    try:
+      sock.setblocking(False)
+      sock.send(response)
+    except OSError:
+      pass
+    try:
+      sock.close()
+    except OSError:
+      pass
+
+  def getStats(self):
+    """Return the current statistics of the server
+
+    @return(dict) : the statistics
+    """
+    return {
+      'requests': self._counter_request,
+      'connections': len(self._d_conn),
+      'rate_limited': self._counter_rate_limited,
+      'overloaded': self._counter_overloaded,
+    }
+
+  def _popRequest(self, conn):
+    """Extract the first complete request from the connection buffer
+
+    A request is complete when its head and its body, if a Content-Length
+    is given, have been received
+    @param(ReplyConnection) conn : the client connection
+    @return(bytes) : the raw request head
+                      None if the request is not complete yet
+    """
+    end = conn.inbuf.find(b'\r\n\r\n')
+    sep = 4
+    if end < 0:
+      end = conn.inbuf.find(b'\n\n')
+      sep = 2
+    if end < 0:
+      if len(conn.inbuf) > self.MAX_REQUEST_SIZE:
+        self._closeConnection(conn)
+      return None
+    head = conn.inbuf[:end + sep]
+    length = 0
+    pos = head.lower().find(b'\ncontent-length:')
+    if pos >= 0:
+      try:
+        length = int(head[pos + 16:head.find(b'\n', pos + 1)])
+      except ValueError:
+        length = -1
+      if length < 0 or length > self.MAX_REQUEST_SIZE:
+        self._closeConnection(conn)
+        return None
+    if len(conn.inbuf) < end + sep + length:
+      return None
+    # the body is not used
+    conn.inbuf = conn.inbuf[end + sep + length:]
+    return head
+
+  def _handle(self, request, address, keep_alive):
+    """Answer a complete request
+
+    HEAD, GET and POST requests receive the pre-encoded response after only
+    their request line and Connection header have been read, all others are
+    parsed by the complete request handler and close the connection
+    @param(bytes) request : the raw request head
+    @param(tuple) address : the client address
+    @param(boolean) keep_alive : if the server accept to keep the connection
+    @return(tuple) : the raw response and the keep-alive state of the
+                      connection
+    """
+    line = request[:request.find(b'\n')].split()
+    if (len(line) == 3 and line[0] in self.FAST_METHODS
+        and line[2].startswith(b'HTTP/')):
+      if keep_alive:
+        keep_alive = self._isKeepAlive(request, line[2])
+      self._onRequest(line[0].decode('ascii'), address)
+      if self._d_route:
+        path, _, query = line[1].partition(b'?')
+        route = self._d_route.get(path)
+        if route:
+          return (self._getRouteResponse(route, query, keep_alive,
+                                         line[0] == b'HEAD'),
+                  keep_alive)
+      return (self.getResponse(keep_alive), keep_alive)
+    handler = HttpReplyHandler(request, address, self)
+    return (handler.wfile.getvalue(), False)
+
+  def _isKeepAlive(self, request, version):
+    """Return the keep-alive state asked by the client
+
+    HTTP/1.1 connections are persistent unless the client send
+    'Connection: close', HTTP/1.0 ones only if it send 'Connection: keep-alive'
+    @param(bytes) request : the raw request head
+    @param(bytes) version : the request HTTP version
+    @return(boolean) : True if the client want to keep the connection
+    """
+    head = request.lower()
+    pos = head.find(b'\nconnection:')
+    if pos < 0:
+      return version >= b'HTTP/1.1'
+    value = head[pos + 12:head.find(b'\n', pos + 1)]
+    if b'close' in value:
+      return False
+    return version >= b'HTTP/1.1' or b'keep-alive' in value
+
+  def getResponse(self, keep_alive = False):
+    """Return the pre-encoded teepot response
+
+    The responses are rebuilt only when their Date header is outdated, so at
+    most once per second
+    @param(boolean) keep_alive : if the connection is kept after the response
+    @return(bytes) : the raw response
+    """
+    now = int(time.time())
+    header = self._header
+    if self._header_provider:
+      header = self._header_provider()
+    if now != self._response_time or header is not self._header:
+      self._date = (b'Date: ' + formatdate(now, usegmt=True).encode('ascii')
+                    + b'\r\n\r\n')
+      self._header = header
+      self._d_response = dict((k, self.RESPONSE_HEAD + v + header + self._date)
+                              for k, v in self.CONNECTION_HEADER.items())
+      self._response_time = now
+    return self._d_response[keep_alive]
+
+  def setHeaderProvider(self, func):
+    """Define a function which return additional header lines of the reply
+
+    The teepot response is rebuilt only when the function return another
+    object than the previous time, so it should cache its result
+    @param(function) func : function called without argument which return
+                            the header lines as bytes, each one terminated
+                            by a line ending
+    """
+    self._header_provider = func
+
+  def setRoute(self, path, func, content_type = 'text/plain', query = False):
+    """Answer HEAD, GET and POST requests on a path by a function
+
+    @param(string) path : the request path, without query string
+    @param(function) func : function called for each request, which return
+                            the body as bytes
+    @param(string) content_type : the content type of the body
+    @param(boolean) query : if True the function is called with the query
+                            string of the request, else without argument
+    """
+    self._d_route[path.encode('ascii')] = (func,
+                                           content_type.encode('ascii'),
+                                           query)
+
+  def _getRouteResponse(self, route, query, keep_alive, head_only):
+    """Build the response of a registered path
+
+    @param(tuple) route : the body function, the content type and if the
+                          function take the query string
+    @param(bytes) query : the query string of the request
+    @param(boolean) keep_alive : if the connection is kept after the response
+    @param(boolean) head_only : if the body must not be sent
+    @return(bytes) : the raw response
+    """
+    func, content_type, with_query = route
+    try:
+      if with_query:
+        body = func(query.decode('ascii', 'replace'))
+      else:
+        body = func()
+      status = b'200 OK'
+    except Exception as e:
+      self._logger.error('Unable to build the response body: %s', e)
+      body = b''
+      status = b'500 Internal Server Error'
+      content_type = b'text/plain'
+    # refresh the date header
+    self.getResponse(keep_alive)
+    response = (b'HTTP/1.1 ' + status + b'\r\n'
+                + b'Content-type: ' + content_type + b'\r\n'
+                + b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n'
+                + self.CONNECTION_HEADER[keep_alive]
+                + self._date)
+    if head_only:
+      return response
+    return response + body
+
+  def setObserver(self, func):
+    """Define a function called with the client address of each request
+
+    @param(function) func : the function, it is called by the event loop
+                            so it must return quickly
+    """
+    self._observer = func
+
+  def _onRequest(self, command, address):
+    """Keep trace of incoming client request
+
+    @param(string) command : the request method
+    @param(tuple) address : the client address
+    """
+    if self._access_log:
+      self._access_log.record(command, address)
+    if self._observer:
+      self._observer(address)
+
+  def _write(self, conn):
+    """Send as much pending data as possible on a connection
+
+    The connection is watched for writing until all data are sent
+    @param(ReplyConnection) conn : the client connection
+    """
+    if conn.outbuf:
+      try:
+        sent = conn.sock.send(conn.outbuf)
+        conn.outbuf = conn.outbuf[sent:]
+        conn.last_activity = time.monotonic()
+      except (BlockingIOError, InterruptedError):
+        pass
+      except OSError:
+        self._closeConnection(conn)
+        return
+    if conn.outbuf:
+      self._selector.modify(conn.sock,
+                            selectors.EVENT_READ | selectors.EVENT_WRITE,
+                            self._serveConnection)
+    elif conn.close_after_write:
+      self._closeConnection(conn)
+    else:
+      self._selector.modify(conn.sock, selectors.EVENT_READ,
+                            self._serveConnection)
+
+  def _expire(self):
+    """Close the connections which are inactive since too long
+
+    The check is done at most once per second
+    """
+    now = time.monotonic()
+    if now - self._last_expire < 1.0:
+      return
+    self._last_expire = now
+    for conn in list(self._d_conn.values()):
+      timeout = self.CONNECTION_TIMEOUT
+      # persistent connections waiting for their next request
+      if conn.requests and not conn.inbuf and not conn.outbuf:
+        timeout = self._keepalive_timeout
+      if now - conn.last_activity > timeout:
+        self._closeConnection(conn)
+    if self._limiter and now - self._last_prune >= self.PRUNE_INTERVAL:
+      self._last_prune = now
+      self._limiter.prune()
+
+  def _closeConnection(self, conn):
+    """Close a client connection and forget it
+
+    @param(ReplyConnection) conn : the client connection
+    """
+    if conn.sock is None:
+      return
+    self._d_conn.pop(conn.sock.fileno(), None)
+    try:
+      self._selector.unregister(conn.sock)
+    except (KeyError, ValueError):
+      pass
+    try:
+      conn.sock.close()
+    except OSError:
+      pass
+    conn.sock = None
+
   def handle_timeout(self):
     """Special handler for periodic event defined by setTimeoutHandler
     
@@ -171,12 +726,62 @@ class HttpTeepotReply(HTTPServer):
 
 
 
+class ReplyConnection:
+  """State of a client connection handled by the event loop
+  """
+
+  def __init__(self, sock, address):
+    """Constructor : Build a connection state
+
+    @param(socket) sock : the non-blocking client socket
+    @param(tuple) address : the client address
+    """
+    self.sock = sock
+    self.address = address
+    # received data not yet handled
+    self.inbuf = b''
+    # response data not yet sent
+    self.outbuf = b''
+    # if the connection must be closed when all data have been sent
+    self.close_after_write = False
+    # number of requests received on this connection
+    self.requests = 0
+    self.last_activity = time.monotonic()
+
+
+
 class HttpReplyHandler(BaseHTTPRequestHandler):
   """Http request reply handler class
   
   Define an extension of the BaseHTTPRequestHandler to handle client queries
+  The handler does not use the client socket, it read a complete request
+  from a buffer and write its response into another buffer which is sent by
+  the server event loop
   """
 
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    """Use memory buffers instead of the socket
+    """
+    self.rfile = io.BytesIO(self.request)
+    self.wfile = io.BytesIO()
+
+  def handle(self):
+    """Handle only the buffered request
+    """
+    self.handle_one_request()
+
+  def finish(self):
+    """Keep the response buffer for the server
+    """
+    pass
+
+  def log_message(self, format, *args):
+    """Send the handler messages to the server logger instead of stderr
+    """
+    self.server._logger.debug('%s - %s', self.client_address[0], format % args)
+
   def do_HEAD(self):
     """Implement handler to HEAD request
     """
@@ -185,10 +790,8 @@ class HttpReplyHandler(BaseHTTPRequestHandler):
   def do_GET(self):
     """Implement handler to GET request
     """
-    self.send_response_only(418, 'I\'m a teepot')
-    self.send_header('Content-type', 'text/plain')
-    self.send_header('Date', self.date_time_string())
-    self.end_headers()
+    self.close_connection = True
+    self.wfile.write(self.server.getResponse(False))
     self._log_client()
 
   def do_POST(self):
@@ -199,11 +802,7 @@ class HttpReplyHandler(BaseHTTPRequestHandler):
   def _log_client(self):
     """Emit logs messages to keep trace of incoming client request
     """
-    if self.server._if_log_client:
-      self.server._logger.info('Receive a %s query from host %s:%s', 
-                              self.command,
-                              self.client_address[0],
-                              self.client_address[1])
+    self.server._onRequest(self.command, self.client_address)
 
 
 
@@ -25,11 +25,22 @@
 """This file contain the program version and release notes
 
 versions_notes :
+  version 1.2 :
+    + serve all connections from a non-blocking event loop
+    + wake up the event loop by a pipe on shutdown
+    + answer HEAD, GET and POST with a pre-encoded response
+    + keep HTTP/1.1 connections alive and answer pipelined requests
+    + add reuse_port option to share the listening port between processes
+    + add per source rate limiting and a maximum number of connections
+    + log client queries from a background thread, with sampling and summary
+    + answer other paths by functions registered with setRoute()
+    + notify a function of each request with setObserver()
+    + add header lines to the reply with setHeaderProvider()
   version 1.1 : 2015-02-08
     + add option to disable client request logging
   version 1.0 : 2015-01-23
     first release
 """
-version = '1.1'
+version = '1.2'
 
 
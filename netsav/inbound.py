@@ -0,0 +1,77 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/inbound module
+
+It provide the record of queries received by the server from watched hosts,
+which clients can use as passive observations of these hosts
+"""
+
+# System imports
+import time
+
+# Projet Imports
+
+
+class InboundTracker:
+  """Record the time of the last query received from each watched host
+
+  Only the server thread write the records and each record is a single dict
+  item assignment, so neither the server nor the clients take a lock
+  """
+
+  def __init__(self):
+    """Constructor : Build an empty tracker
+    """
+    # the watched addresses
+    self._s_watch = set()
+    # monotonic time of the last query by address
+    self._d_last = dict()
+
+  def watch(self, host):
+    """Start to record the queries received from an address
+
+    @param[string] host : the IP address
+    """
+    self._s_watch.add(host)
+
+  def record(self, address):
+    """Record a query received from a client address
+
+    @param[tuple] address : the client address
+    """
+    if address[0] in self._s_watch:
+      self._d_last[address[0]] = time.monotonic()
+
+  def getAge(self, host):
+    """Return the time elapsed since the last query received from an address
+
+    @param[string] host : the IP address
+    @return[float] : the number of seconds
+                      None if no query has been received
+    """
+    last = self._d_last.get(host)
+    if last is None:
+      return None
+    return time.monotonic() - last
@@ -0,0 +1,248 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/journal module
+
+It provide an append only journal in which trigger events are written before
+being queued. Each trigger acknowledges the events it has handled, so the
+events that are not acknowledged by all triggers can be replayed after a
+restart
+"""
+
+# System imports
+import json
+import logging
+import os
+import threading
+import time
+
+# Projet Imports
+
+# Global project declarations
+sys_log = logging.getLogger('netsav')
+
+
+class Journal:
+  """Durable trigger event journal
+
+  The journal is a file of json lines. Three kinds of entries are written :
+    {"id": <int>, "event": <dict>} when an event is queued
+    {"id": <int>, "ack": <string>} when a trigger has handled the event
+    {"id": <int>, "done": true} when the event needs no more handling, as
+                                 when it has been dropped from the queue
+  Appending only write into the system buffer, the file is fsync'ed at most
+  once per sync interval by the trigger serving thread.
+  When the number of entries become too large compared to the number of
+  pending events, the file is rewritten with only the pending ones
+  """
+
+  def __init__(self, path, sync_interval=1.0, compact_threshold=1000):
+    """Constructor : Build a journal object
+
+    @param[string] path : the path of the journal file
+    @param[float] sync_interval : the minimum delay between two fsync
+    @param[int] compact_threshold : the minimum number of entries in file
+                                    before a compaction
+    """
+    self.path = path
+    self.sync_interval = sync_interval
+    self.compact_threshold = compact_threshold
+    # lock between client threads which append and the serving thread
+    self._lock = threading.Lock()
+    # the opened journal file
+    self._file = None
+    # the last used event identifier
+    self._last_id = 0
+    # pending events indexed by id, each entry is a [value, acks set] pair
+    self._d_pending = dict()
+    # number of entries in the journal file
+    self._counter_entry = 0
+    # if some entries have been written since the last fsync
+    self._dirty = False
+    self._last_sync = time.monotonic()
+
+  def open(self):
+    """Read the existing journal file and open it for appending
+
+    @return[list] : the list of pending events as (id, value, acks set)
+                    tuples in their arrival order
+    """
+    self._d_pending = dict()
+    self._counter_entry = 0
+    try:
+      with open(self.path, 'r') as f:
+        for line in f:
+          self._readEntry(line)
+    except FileNotFoundError:
+      pass
+    self._file = open(self.path, 'a')
+    sys_log.debug('[JOURNAL] Opened journal ' + self.path + ' with ' +
+                  str(len(self._d_pending)) + ' pending event(s)')
+    return [(i, v[0], set(v[1])) for i, v in sorted(self._d_pending.items())]
+
+  def close(self):
+    """Sync and close the journal file
+    """
+    with self._lock:
+      if self._file is None:
+        return
+      self._sync()
+      self._file.close()
+      self._file = None
+
+  def append(self, value):
+    """Write a new event into the journal
+
+    @param[dict] value : the event
+    @return[int] : the identifier of the event
+    """
+    with self._lock:
+      self._last_id += 1
+      self._d_pending[self._last_id] = [value, set()]
+      self._write({'id': self._last_id, 'event': value})
+      return self._last_id
+
+  def ack(self, event_id, name):
+    """Record that a trigger has handled an event
+
+    @param[int] event_id : the identifier of the event
+    @param[string] name : the name of the trigger
+    """
+    with self._lock:
+      if event_id in self._d_pending:
+        self._d_pending[event_id][1].add(name)
+        self._write({'id': event_id, 'ack': name})
+
+  def complete(self, event_id):
+    """Forget an event which has been handled by all triggers or dropped
+
+    @param[int] event_id : the identifier of the event
+    """
+    with self._lock:
+      if self._d_pending.pop(event_id, None) is not None:
+        self._write({'id': event_id, 'done': True})
+
+  def sync(self, force=False):
+    """Flush the journal on disk if the sync interval has expired
+
+    @param[boolean] force : if True sync whatever the interval
+    """
+    with self._lock:
+      if self._file is None or not self._dirty:
+        return
+      if not force and time.monotonic() - self._last_sync < self.sync_interval:
+        return
+      self._sync()
+      self._compact()
+
+  def getSyncTimeout(self):
+    """Return the remaining time before the next needed sync
+
+    @return[float] : the number of seconds
+                      None if there is nothing to sync
+    """
+    if not self._dirty:
+      return None
+    return max(0, self._last_sync + self.sync_interval - time.monotonic())
+
+  def _readEntry(self, line):
+    """Parse one journal line and update the pending events
+
+    @param[string] line : the json line
+    """
+    try:
+      entry = json.loads(line)
+      event_id = int(entry['id'])
+    except (ValueError, KeyError, TypeError):
+      # a partially written last line
+      sys_log.warning('[JOURNAL] Ignoring corrupted entry in ' + self.path)
+      return
+    self._counter_entry += 1
+    self._last_id = max(self._last_id, event_id)
+    if 'event' in entry:
+      self._d_pending[event_id] = [entry['event'], set()]
+    elif 'ack' in entry and event_id in self._d_pending:
+      self._d_pending[event_id][1].add(entry['ack'])
+    elif entry.get('done'):
+      self._d_pending.pop(event_id, None)
+
+  def _write(self, entry):
+    """Append an entry to the journal file (the lock must be hold)
+
+    @param[dict] entry : the entry to write
+    """
+    if self._file is None:
+      return
+    try:
+      self._file.write(json.dumps(entry, default=str) + '\n')
+      self._file.flush()
+      self._counter_entry += 1
+      self._dirty = True
+    except (OSError, ValueError) as e:
+      sys_log.error('[JOURNAL] Unable to write into ' + self.path + ': ' +
+                    str(e))
+
+  def _sync(self):
+    """Fsync the journal file (the lock must be hold)
+    """
+    try:
+      os.fsync(self._file.fileno())
+    except OSError as e:
+      sys_log.error('[JOURNAL] Unable to sync ' + self.path + ': ' + str(e))
+    self._dirty = False
+    self._last_sync = time.monotonic()
+
+  def _compact(self):
+    """Rewrite the journal file with only pending events (the lock must be hold)
+
+    The compaction only happen when the file contains more than the threshold
+    number of entries and at least twice more entries than needed
+    """
+    needed = 0
+    for value, acks in self._d_pending.values():
+      needed += 1 + len(acks)
+    if (self._counter_entry < self.compact_threshold or
+        self._counter_entry < 2 * needed):
+      return
+
+    tmp_path = self.path + '.tmp'
+    try:
+      with open(tmp_path, 'w') as f:
+        for event_id, (value, acks) in sorted(self._d_pending.items()):
+          f.write(json.dumps({'id': event_id, 'event': value},
+                             default=str) + '\n')
+          for name in acks:
+            f.write(json.dumps({'id': event_id, 'ack': name}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, self.path)
+    except OSError as e:
+      sys_log.error('[JOURNAL] Unable to compact ' + self.path + ': ' + str(e))
+      return
+    self._file.close()
+    self._file = open(self.path, 'a')
+    sys_log.debug('[JOURNAL] Compacted journal from ' +
+                  str(self._counter_entry) + ' to ' + str(needed) +
+                  ' entries')
+    self._counter_entry = needed
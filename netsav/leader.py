@@ -0,0 +1,234 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/leader module
+
+It provide the election of the node which dispatch the triggers of the
+cluster, by leases granted through the nodes servers
+"""
+
+# System imports
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+import json
+import logging
+import random
+import threading
+from threading import Thread
+import time
+from urllib.parse import parse_qs, quote
+
+# Projet Imports
+
+# Global project declarations
+sys_log = logging.getLogger('netsav')
+
+
+class LeaderElection(Thread):
+  """Elect a single leader among the cluster nodes
+
+  A node is the leader while it holds a lease granted by a majority of the
+  nodes. Each node grant the lease to a single node at a time, until the
+  lease expires or is renewed by its holder, so two nodes cannot hold a
+  lease at the same time. The leader renews its lease three times per lease
+  duration, when it stops, another node is elected after the lease expiry
+  """
+
+  # path of the lease endpoint on the server
+  PATH = '/lease'
+
+  def __init__(self, event, gossip):
+    """Constructor : Build an election thread
+
+    @param[threading.Event] event : the event object which define
+                                    this tread life state
+    @param[Gossip] gossip : the gossip instance which know the node name,
+                            the peers and the alive nodes
+    """
+    self.__event_stop = event
+    self.__gossip = gossip
+    self.node = gossip.node
+    # number of seconds of a lease
+    self.lease_duration = 10
+    self.tcp_timeout = 2
+
+    self._lock = threading.Lock()
+    # the node to which this node has granted the lease and the expiry
+    self._holder = None
+    self._holder_until = 0
+    # the monotonic time until which this node is the leader
+    self._lease_until = 0
+    # the monotonic time since which no lease is known
+    self._vacant_since = time.monotonic()
+    Thread.__init__(self, name='LEADER')
+
+  def load(self, config):
+    """Load election configuration
+
+    @param[dict] config : the cluster configuration dict
+    @return[boolean] : True if load success
+                      False otherwise
+    """
+    if config.get('lease_duration'):
+      self.lease_duration = max(3, config['lease_duration'])
+    return True
+
+  def run(self):
+    """Run the thread
+    """
+    l_peer = self.__gossip.l_peer
+    with ThreadPoolExecutor(max_workers=len(l_peer)) as executor:
+      while not self.__event_stop.isSet():
+        if self.isLeader() or self.__shouldCampaign():
+          self.__acquire(executor, l_peer)
+        wait = self.lease_duration / 3.0
+        if not self.isLeader():
+          # spread the campaigns of the nodes which start together
+          wait *= random.uniform(0.5, 1.0)
+        self.__event_stop.wait(wait)
+
+  def isLeader(self):
+    """Return True if this node holds a valid lease
+    """
+    return time.monotonic() < self._lease_until
+
+  def getLeader(self):
+    """Return the node to which this node has granted the lease
+
+    @return[string] : the node name
+                      None if no lease is known
+    """
+    with self._lock:
+      if time.monotonic() < self._holder_until:
+        return self._holder
+    return None
+
+  def __shouldCampaign(self):
+    """Return True if this node must ask the lease
+
+    The first alive node campaigns as soon as no lease is known, the others
+    only if the lease is vacant since a full lease duration
+    """
+    with self._lock:
+      now = time.monotonic()
+      if now < self._holder_until:
+        self._vacant_since = now
+        return False
+    if self.__gossip.getAliveNodes()[0] == self.node:
+      return True
+    return now - self._vacant_since > self.lease_duration
+
+  def __acquire(self, executor, l_peer):
+    """Ask or renew the lease to all nodes
+
+    @param[ThreadPoolExecutor] executor : the executor on which run requests
+    @param[list] l_peer : the list of (address, port) of the peers
+    """
+    start = time.monotonic()
+    granted = 1 if self.grant(self.node, self.lease_duration) else 0
+    if not granted:
+      return
+    l_future = [executor.submit(self.__request, peer) for peer in l_peer]
+    for future in l_future:
+      if future.result():
+        granted += 1
+    was_leader = self.isLeader()
+    if granted > (len(l_peer) + 1) // 2:
+      # the peers count the lease from the reception of the request
+      self._lease_until = start + self.lease_duration
+      if not was_leader:
+        sys_log.info('[LEADER] %s is now the leader', self.node)
+    else:
+      with self._lock:
+        # let the other nodes be elected
+        if self._holder == self.node:
+          self._holder_until = 0
+      if was_leader:
+        sys_log.warning('[LEADER] %s has lost the leadership', self.node)
+
+  def __request(self, peer):
+    """Ask the lease to a peer
+
+    @param[tuple] peer : the (address, port) of the peer server
+    @return[boolean] : True if the peer has granted the lease
+    """
+    path = (self.PATH + '?n=' + quote(self.node, safe='')
+            + '&d=' + str(self.lease_duration))
+    h = HTTPConnection(peer[0], peer[1], timeout=self.tcp_timeout)
+    try:
+      h.request('GET', path)
+      res = h.getresponse()
+      if res.status != 200:
+        return False
+      return bool(json.loads(res.read().decode('utf-8')).get('granted'))
+    except (OSError, HTTPException, ValueError, AttributeError) as e:
+      sys_log.debug('[LEADER] unable to ask the lease to %s:%d : %s',
+                    peer[0], peer[1], e)
+      return False
+    finally:
+      h.close()
+
+  def grant(self, node, duration):
+    """Grant the lease to a node if no other node holds it
+
+    @param[string] node : the asking node
+    @param[int] duration : the number of seconds of the lease
+    @return[boolean] : True if the lease is granted
+    """
+    with self._lock:
+      now = time.monotonic()
+      if self._holder == node or now >= self._holder_until:
+        if self._holder != node:
+          sys_log.debug('[LEADER] grant the lease to %s', node)
+        self._holder = node
+        self._holder_until = now + duration
+        return True
+      return False
+
+  def getLease(self, query):
+    """Answer a lease request
+
+    This is the body function of the lease endpoint, without the 'n' and
+    'd' parameters it only return the current holder. The lease is only
+    granted to the alive nodes known by gossip and for at most the local
+    lease duration, because the cluster configuration is shared
+    @param[string] query : the request query string
+    @return[bytes] : the JSON document
+    """
+    d_query = parse_qs(query)
+    granted = False
+    try:
+      node = d_query['n'][0]
+      duration = min(int(d_query['d'][0]), self.lease_duration)
+      if node != self.node and duration > 0:
+        if node in self.__gossip.getAliveNodes():
+          granted = self.grant(node, duration)
+        else:
+          sys_log.debug('[LEADER] refuse the lease to unknown node %s', node)
+    except (KeyError, ValueError):
+      pass
+    doc = {'node': self.node,
+           'granted': granted,
+           'holder': self.getLeader()}
+    return json.dumps(doc).encode('utf-8')
@@ -0,0 +1,237 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/metrics module
+
+It provide the counters exported in the Prometheus text format by the
+metrics endpoint of the server
+"""
+
+# System imports
+from bisect import bisect_left
+
+# Projet Imports
+
+
+class ProbeMetrics:
+  """The probe counters of a single client
+
+  All counters are allocated once and only updated by the client thread,
+  so they do not need any lock. A reader can see a probe counted in the
+  total but not yet in the histogram, which is harmless for scraping
+  """
+
+  # upper bounds of the latency histogram buckets in seconds
+  BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+  def __init__(self):
+    """Constructor : Build zeroed counters
+    """
+    self.probes = 0
+    self.failures = 0
+    self.passive = 0
+    # number of latencies in each bucket, the last one is +Inf
+    self.l_bucket = [0] * (len(self.BUCKETS) + 1)
+    self.latency_sum = 0.0
+    self.latency_count = 0
+
+  def observe(self, latency):
+    """Count a successful probe
+
+    @param[float] latency : the duration of the probe in seconds,
+                            None if unknown
+    """
+    self.probes += 1
+    if latency is not None:
+      self.l_bucket[bisect_left(self.BUCKETS, latency)] += 1
+      self.latency_sum += latency
+      self.latency_count += 1
+
+  def observePassive(self):
+    """Count an observation made from a query received from the host
+    """
+    self.passive += 1
+
+  def fail(self):
+    """Count a failed probe
+    """
+    self.probes += 1
+    self.failures += 1
+
+
+class Metrics:
+  """The registry of all counters of the program
+
+  Client counters are preallocated by register(), the other values are read
+  from the sources given by setSource() only when the document is rendered
+  """
+
+  def __init__(self):
+    """Constructor : Build an empty registry
+    """
+    self._d_probe = dict()
+    self._d_state = dict()
+    # objects which provide getStats() by name
+    self._d_source = dict()
+
+  def register(self, name, state):
+    """Allocate the counters of a client
+
+    @param[string] name : the client name
+    @param[function] state : function which return the client state
+    @return[ProbeMetrics] : the counters of the client
+    """
+    probe = ProbeMetrics()
+    self._d_probe[name] = probe
+    self._d_state[name] = state
+    return probe
+
+  def setSource(self, name, source):
+    """Register an object whose getStats() is exported
+
+    Known names are 'trigger' (TriggerLoader), 'sync' (Sync)
+    and 'server' (HttpTeepotReply)
+    @param[string] name : the source name
+    @param[object] source : the object
+    """
+    self._d_source[name] = source
+
+  def render(self):
+    """Return the metrics document in the Prometheus text format
+
+    @return[bytes] : the encoded document
+    """
+    lines = []
+
+    def metric(name, kind, help, l_sample):
+      lines.append('# HELP ' + name + ' ' + help)
+      lines.append('# TYPE ' + name + ' ' + kind)
+      for suffix, labels, value in l_sample:
+        lines.append(name + suffix + labels + ' ' + self._format(value))
+
+    l_name = sorted(self._d_probe)
+    metric('netsav_probes_total', 'counter',
+           'Number of probes made by a client',
+           [('', self._labels(client=n), self._d_probe[n].probes)
+            for n in l_name])
+    metric('netsav_probe_failures_total', 'counter',
+           'Number of probes of a client which have failed',
+           [('', self._labels(client=n), self._d_probe[n].failures)
+            for n in l_name])
+    metric('netsav_passive_observations_total', 'counter',
+           'Number of probes of a client replaced by a query from the host',
+           [('', self._labels(client=n), self._d_probe[n].passive)
+            for n in l_name])
+    l_sample = []
+    for n in l_name:
+      probe = self._d_probe[n]
+      count = 0
+      for i, bound in enumerate(ProbeMetrics.BUCKETS + (float('inf'),)):
+        count += probe.l_bucket[i]
+        l_sample.append(('_bucket',
+                         self._labels(client=n, le=self._format(bound)),
+                         count))
+      l_sample.append(('_sum', self._labels(client=n), probe.latency_sum))
+      l_sample.append(('_count', self._labels(client=n), probe.latency_count))
+    metric('netsav_probe_latency_seconds', 'histogram',
+           'Latency of the successful probes of a client', l_sample)
+    metric('netsav_client_state', 'gauge',
+           'State of a client, 0 unavailable, 1 available, 2 unknown',
+           [('', self._labels(client=n), self._d_state[n]()) for n in l_name])
+
+    if 'sync' in self._d_source:
+      stats = self._d_source['sync'].getStats()
+      metric('netsav_references', 'gauge', 'Number of reference clients',
+             [('', '', stats['references'])])
+      metric('netsav_references_down', 'gauge',
+             'Number of reference clients which are down',
+             [('', '', stats['references_down'])])
+      metric('netsav_clients_active', 'gauge',
+             'Whether the non reference clients are enabled',
+             [('', '', stats['active'])])
+
+    if 'trigger' in self._d_source:
+      stats = self._d_source['trigger'].getStats()
+      metric('netsav_trigger_queue_depth', 'gauge',
+             'Number of events waiting in the trigger queue',
+             [('', '', stats['depth'])])
+      metric('netsav_trigger_queue_capacity', 'gauge',
+             'Maximum number of events in the trigger queue, 0 for unbounded',
+             [('', '', stats['capacity'])])
+      metric('netsav_trigger_dropped_total', 'counter',
+             'Number of events dropped by the trigger queue',
+             [('', self._labels(reason=r), stats[r])
+              for r in ['dropped', 'collapsed', 'duplicate']])
+      metric('netsav_trigger_dispatched_total', 'counter',
+             'Number of events dispatched to triggers',
+             [('', '', stats['dispatched'])])
+      metric('netsav_trigger_dispatch_age_seconds', 'gauge',
+             'Average and maximum time spent by events before dispatch',
+             [('', self._labels(stat='avg'), stats['age_avg']),
+              ('', self._labels(stat='max'), stats['age_max'])])
+      metric('netsav_trigger_retrying', 'gauge',
+             'Number of events waiting for a retry',
+             [('', '', stats['retrying'])])
+      metric('netsav_trigger_dead_letter_total', 'counter',
+             'Number of events which have failed after all their retries',
+             [('', '', stats['dead_letter'])])
+
+    if 'server' in self._d_source:
+      stats = self._d_source['server'].getStats()
+      metric('netsav_server_requests_total', 'counter',
+             'Number of requests answered by the server',
+             [('', '', stats['requests'])])
+      metric('netsav_server_rejected_total', 'counter',
+             'Number of requests or connections rejected by the server',
+             [('', self._labels(reason=r), stats[r])
+              for r in ['rate_limited', 'overloaded']])
+      metric('netsav_server_connections', 'gauge',
+             'Number of open connections on the server',
+             [('', '', stats['connections'])])
+
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+  @staticmethod
+  def _labels(**labels):
+    """Return the label set of a sample
+
+    @return[string] : the labels between braces
+    """
+    return ('{' + ','.join(k + '="' + str(v).replace('\\', '\\\\')
+                                            .replace('"', '\\"') + '"'
+                           for k, v in sorted(labels.items())) + '}')
+
+  @staticmethod
+  def _format(value):
+    """Return the text representation of a sample value
+
+    @param[number] value : the value
+    @return[string] : the value as Prometheus expect it
+    """
+    if isinstance(value, bool):
+      return '1' if value else '0'
+    if value == float('inf'):
+      return '+Inf'
+    return repr(value)
@@ -41,6 +41,13 @@ import time
 
 # Projet Imports
 from .config import NetsavConfigParser
+from .consensus import Consensus
+from .gossip import Gossip
+from .inbound import InboundTracker
+from .leader import LeaderElection
+from .sharding import ProbeSharding
+from .metrics import Metrics
+from .status import StatusBoard
 from .sync import Sync
 from .triggerloader import TriggerLoader
 from .server.server import Server
@@ -89,6 +96,21 @@ class Netsav:
     self.__event_active.set()
     # New lock instance
     self.__sync = Sync(self.__event_active)
+    # board of the client states
+    self.__status = StatusBoard(self.__event_active)
+    # registry of the exported counters
+    self.__metrics = Metrics()
+    self.__metrics.setSource('sync', self.__sync)
+    # record of the queries received from clients hosts
+    self.__inbound = InboundTracker()
+    # thread which share the states with the other nodes
+    self.__gossip = None
+    # assignment of the hosts to the nodes
+    self.__sharding = None
+    # votes of the nodes on the hosts availability
+    self.__consensus = None
+    # election of the node which run the triggers
+    self.__election = None
 
   def load(self, config):
     """Load configuration function
@@ -102,7 +124,7 @@ class Netsav:
       if self.cp.load(config):
         self.setLogLevel(self.cp.getOptLogLevel())
         self.setLogTarget(self.cp.getOptLogTarget())
-        return True
+        return self.cp.check()
     return False
 
   def start(self, pid_path):
@@ -144,6 +166,27 @@ class Netsav:
     except IOError as e:
       sys_log.error("Unable to create PID file: %s", pid_path)
 
+    # Init cluster state sharing
+    cluster = self.cp.getClusterConfigDict()
+    if cluster['peers']:
+      gossip = Gossip(self.__event_stop, self.__status)
+      if gossip.load(cluster):
+        self.__gossip = gossip
+        sys_log.info("Sharing states with %d peers as node %s",
+                     len(gossip.l_peer), gossip.node)
+        if cluster.get('replicas'):
+          self.__sharding = ProbeSharding(gossip, cluster['replicas'])
+        if cluster.get('quorum'):
+          self.__consensus = Consensus(gossip, cluster['quorum'])
+          gossip.setListener(lambda origin, name, state:
+                             self.__consensus.observe(name, state, origin))
+        if cluster.get('election'):
+          election = LeaderElection(self.__event_stop, gossip)
+          if election.load(cluster):
+            self.__election = election
+      else:
+        sys_log.error('Failed to load cluster configuration')
+
     # Init clients objects
     client_list = self.cp.getClientConfigDict()
     for name in client_list:
@@ -154,6 +197,13 @@ class Netsav:
         cli = Client(self.__event_stop, self.__event_active, self.__sync)
         if cli.load(client_list[name]) and cli.check():
           cli.setTrigger(self.getTrigger())
+          cli.setStatusBoard(self.__status)
+          cli.setMetrics(self.__metrics)
+          cli.setInboundTracker(self.__inbound)
+          cli.setSharding(self.__sharding)
+          cli.setConsensus(self.__consensus)
+          cli.setElection(self.__election)
+          cli.setGossip(self.__gossip)
           self.__l_client.append(cli)
           sys_log.info("Added client : %s", name)
         else:
@@ -162,9 +212,21 @@ class Netsav:
     # Init server object
     self.__server = Server(self.__event_stop)
     if self.__server.load(self.cp.getServerConfigDict()) and self.__server.open():
+      self.__server.setStatusBoard(self.__status)
+      self.__metrics.setSource('trigger', self.getTrigger())
+      self.__server.setMetrics(self.__metrics)
+      if [c for c in self.__l_client if c.passive]:
+        self.__server.setInboundTracker(self.__inbound)
+      if self.__gossip:
+        self.__server.setGossip(self.__gossip)
+      if self.__election:
+        self.__server.setElection(self.__election)
       # Run the main loop
       self.__downgrade()
-      self.run()
+      if self.__server.spawn():
+        self.run()
+      else:
+        sys_log.error('Error during server workers starting')
     else:
       sys_log.error('Error during server opening')
 
@@ -191,6 +253,12 @@ class Netsav:
     try:
       sys_log.debug("Starting server thread")
       self.__server.start()
+      if self.__gossip:
+        sys_log.debug("Starting gossip thread")
+        self.__gossip.start()
+      if self.__election:
+        sys_log.debug("Starting leader election thread")
+        self.__election.start()
 
       if self.hasClient():
         sys_log.debug("Starting all client thread")
@@ -219,10 +287,20 @@ class Netsav:
     sys_log.debug('Send exit command to all thread')
     # send stop command via synchronised event
     self.__event_stop.set()
+    # wake up the server event loop
+    if self.__server:
+      self.__server.stop()
 
     # ensure that all of them have exit, and add eventual event to trig queue
     sys_log.debug('Waiting for all subthread exiting')
-    while (threading.enumerate().__len__()) > 1:
+    l_thread = list(self.__l_client)
+    if self.__server:
+      l_thread.append(self.__server)
+    if self.__gossip and self.__gossip.is_alive():
+      l_thread.append(self.__gossip)
+    if self.__election and self.__election.is_alive():
+      l_thread.append(self.__election)
+    while [t for t in l_thread if t.is_alive()]:
       self.getTrigger().serve_once()
       time.sleep(0.5)
 
@@ -230,6 +308,9 @@ class Netsav:
     sys_log.debug('Purge and serve all event in the queue')
     while (self.getTrigger().serve_once()):
       pass
+    # deliver digest which are still waiting for the end of their window
+    self.getTrigger().flush()
+    self.getTrigger().close()
 
     # Close log
     logging.shutdown()
@@ -0,0 +1,149 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/ratelimit module
+
+It provide token bucket rate limiters
+"""
+
+# System imports
+import threading
+import time
+
+# Projet Imports
+
+
+class TokenBucket:
+  """A single token bucket
+
+  The bucket contains at most 'burst' tokens and is refilled with 'rate'
+  tokens per second. Each allowed action consume one token
+  """
+
+  def __init__(self, rate, burst):
+    """Constructor : Build a full bucket
+
+    @param[float] rate : the number of tokens added per second
+    @param[int] burst : the maximum number of tokens
+    """
+    self.rate = float(rate)
+    self.burst = max(1, burst)
+    self.tokens = float(self.burst)
+    self.last = time.monotonic()
+
+  def refill(self, now):
+    """Add the tokens earned since the last refill
+
+    @param[float] now : the current monotonic time
+    """
+    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+    self.last = now
+
+  def consume(self, now=None):
+    """Try to consume one token
+
+    @param[float] now : the current monotonic time
+    @return[boolean] : True if a token has been consumed
+                       False if the bucket is empty
+    """
+    if now is None:
+      now = time.monotonic()
+    self.refill(now)
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True
+    return False
+
+  def getDelay(self, now=None):
+    """Return the time before a token is available
+
+    @param[float] now : the current monotonic time
+    @return[float] : the number of seconds
+    """
+    if now is None:
+      now = time.monotonic()
+    self.refill(now)
+    if self.tokens >= 1:
+      return 0.0
+    if self.rate <= 0:
+      return float('inf')
+    return (1 - self.tokens) / self.rate
+
+  def isFull(self):
+    """Return True if the bucket has all its tokens
+    """
+    return self.tokens >= self.burst
+
+
+class RateLimiter:
+  """A thread safe set of token buckets indexed by a key
+  """
+
+  def __init__(self, rate, burst):
+    """Constructor : Build an empty rate limiter
+
+    @param[float] rate : the number of tokens added per second in each bucket
+    @param[int] burst : the maximum number of tokens in each bucket
+    """
+    self.rate = rate
+    self.burst = burst
+    self._lock = threading.Lock()
+    self._d_bucket = dict()
+
+  def allow(self, key):
+    """Try to consume one token from the bucket of a key
+
+    @param[object] key : the bucket key
+    @return[boolean] : True if the action is allowed
+                       False otherwise
+    """
+    with self._lock:
+      bucket = self._d_bucket.get(key)
+      if bucket is None:
+        bucket = TokenBucket(self.rate, self.burst)
+        self._d_bucket[key] = bucket
+      return bucket.consume()
+
+  def getDelay(self, key):
+    """Return the time before a token is available for a key
+
+    @param[object] key : the bucket key
+    @return[float] : the number of seconds
+    """
+    with self._lock:
+      bucket = self._d_bucket.get(key)
+      if bucket is None:
+        return 0.0
+      return bucket.getDelay()
+
+  def prune(self):
+    """Forget the buckets which are full, they are equivalent to new ones
+    """
+    now = time.monotonic()
+    with self._lock:
+      for key in list(self._d_bucket):
+        bucket = self._d_bucket[key]
+        bucket.refill(now)
+        if bucket.isFull():
+          del self._d_bucket[key]
@@ -0,0 +1,144 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/router module
+
+It provide the routing table which select the triggers of an event
+"""
+
+# System imports
+import fnmatch
+import re
+
+# Projet Imports
+
+
+class TriggerRouter:
+  """Routing table of trigger events
+
+  Each trigger can declare some routing rules, by dimension :
+    client : patterns matched against the client name
+    tag : patterns matched against the event tag
+    state : patterns matched against the new state name (as 'UNAVAILABLE')
+            and against the transition (as 'AVAILABLE>UNAVAILABLE')
+    group : patterns matched against each group of the client
+  A trigger receive an event if for each of its dimensions at least one
+  pattern match. A trigger without rule receive all events.
+  Patterns are shell wildcards. Exact client names are indexed, all other
+  patterns of a dimension are compiled into one regular expression, and the
+  result of each distinct event key is cached
+  """
+
+  DIMENSIONS = ['client', 'tag', 'state', 'group']
+  # maximum number of cached routing results
+  CACHE_SIZE = 4096
+
+  def __init__(self):
+    """Constructor : Build an empty routing table
+    """
+    # list of (order, trigger, dict of compiled regex by dimension)
+    self._l_route = []
+    # exact client name index, set of route orders indexed by name
+    self._d_client = dict()
+    # routing result indexed by event key
+    self._d_cache = dict()
+
+  def add(self, trigger, rules=None):
+    """Add a trigger and its rules to the table
+
+    @param[TriggerHandler] trigger : the trigger object
+    @param[dict] rules : the list of patterns indexed by dimension
+    """
+    order = len(self._l_route)
+    d_regex = dict()
+    for dim, l_pattern in (rules or dict()).items():
+      if dim not in self.DIMENSIONS:
+        raise ValueError('Unknown routing dimension "' + dim + '"')
+      if not l_pattern:
+        continue
+      if dim == 'client':
+        l_glob = [p for p in l_pattern if self._isGlob(p)]
+        for name in l_pattern:
+          if not self._isGlob(name):
+            self._d_client.setdefault(name, set()).add(order)
+        d_regex[dim] = self._compile(l_glob)
+      else:
+        d_regex[dim] = self._compile(l_pattern)
+    self._l_route.append((order, trigger, d_regex))
+    self._d_cache = dict()
+
+  def route(self, value):
+    """Return the triggers which must receive an event
+
+    @param[dict] value : the event value
+    @return[list] : the list of trigger objects in their adding order
+    """
+    key = (value.get('name'),
+           value.get('tag'),
+           value.get('previous_state_str'),
+           value.get('current_state_str'),
+           value.get('group'))
+    l_trigger = self._d_cache.get(key)
+    if l_trigger is not None:
+      return l_trigger
+
+    name, tag, previous, current, group = [str(k or '') for k in key]
+    d_subject = {'client': [name],
+                 'tag': [tag],
+                 'state': [current, previous + '>' + current],
+                 'group': [g.strip() for g in group.split(',') if g.strip()]}
+    exact = self._d_client.get(name, set())
+    l_trigger = []
+    for order, trigger, d_regex in self._l_route:
+      for dim, regex in d_regex.items():
+        if dim == 'client' and order in exact:
+          continue
+        if not any(regex.match(s) for s in d_subject[dim]):
+          break
+      else:
+        l_trigger.append(trigger)
+
+    if len(self._d_cache) >= self.CACHE_SIZE:
+      self._d_cache = dict()
+    self._d_cache[key] = l_trigger
+    return l_trigger
+
+  @staticmethod
+  def _isGlob(pattern):
+    """Return True if a pattern contains shell wildcards
+    """
+    return any(c in pattern for c in '*?[')
+
+  @staticmethod
+  def _compile(l_pattern):
+    """Compile a list of shell patterns into one regular expression
+
+    @param[list] l_pattern : the list of patterns
+    @return[re] : the compiled expression, which never match if the list
+                  is empty
+    """
+    if not l_pattern:
+      return re.compile('(?!)')
+    return re.compile('|'.join('(?:' + fnmatch.translate(p) + ')'
+                               for p in l_pattern))
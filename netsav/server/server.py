@@ -24,11 +24,15 @@
 
 # System imports
 import logging
+import os
+import signal
+import socket
 from socket import error as Error
 from threading import Thread
 
 # Projet Imports
 from ..httpteepotreply.httpteepotreply import HttpTeepotReply
+from ..ratelimit import RateLimiter
 
 # Global project declarations
 sys_log = logging.getLogger('netsav')
@@ -36,6 +40,9 @@ sys_log = logging.getLogger('netsav')
 
 class Server(Thread):
   """Simple HTTP Server class that make light answer to http queries
+
+  With workers, the server forks as many responder processes which all listen
+  on the same port with SO_REUSEPORT, and the thread only supervises them
   """
 
   def __init__(self, event):
@@ -50,9 +57,24 @@ class Server(Thread):
     self.address = None
     self.port = None
     self.log_client = True
+    self.keepalive_timeout = 5
+    self.keepalive_max = 100
+    self.workers = 0
+    self.rate = 0
+    self.rate_burst = 10
+    self.max_connections = 0
+    self.log_sample = 1
+    self.log_aggregate = 0
+    self.status = False
+    self.metrics = False
+    self.share_state = False
 
     # Server instance
     self.http = None
+    # the server instances of the worker processes
+    self.__l_worker_http = []
+    # the pid of the worker processes
+    self.__l_worker_pid = []
     Thread.__init__(self, name='HTTP_SERVER')
 
   def load(self, config):
@@ -67,15 +89,129 @@ class Server(Thread):
       self.port = config['port']
       if 'log_client' in config:
         self.log_client = config['log_client']
+      if config.get('keepalive_timeout') is not None:
+        self.keepalive_timeout = config['keepalive_timeout']
+      if config.get('keepalive_max') is not None:
+        self.keepalive_max = config['keepalive_max']
+      if config.get('workers'):
+        self.workers = max(0, config['workers'])
+      if config.get('rate'):
+        self.rate = config['rate']
+      if config.get('rate_burst'):
+        self.rate_burst = config['rate_burst']
+      if config.get('max_connections'):
+        self.max_connections = config['max_connections']
+      if config.get('log_sample') is not None:
+        self.log_sample = config['log_sample']
+      if config.get('log_aggregate'):
+        self.log_aggregate = config['log_aggregate']
+      if 'status' in config:
+        self.status = config['status']
+      if 'metrics' in config:
+        self.metrics = config['metrics']
+      if 'share_state' in config:
+        self.share_state = config['share_state']
     else:
       raise Exception('Invalid configuration type')
-    self.http = HttpTeepotReply(self.address,
-                                self.port,
-                                sys_log,
-                                bind_and_activate=False,
-                                log_client=self.log_client)
+    if self.workers and not hasattr(socket, 'SO_REUSEPORT'):
+      sys_log.error('SO_REUSEPORT is not available, responder workers disabled')
+      self.workers = 0
+    self.http = self.__buildServer()
+    if self.workers:
+      self.__l_worker_http = [self.http]
+      for i in range(1, self.workers):
+        self.__l_worker_http.append(self.__buildServer())
     return True
 
+  def __buildServer(self):
+    """Build a new HTTP server instance from the loaded settings
+
+    @return[HttpTeepotReply] : the server instance
+    """
+    limiter = None
+    if self.rate > 0:
+      limiter = RateLimiter(self.rate, self.rate_burst)
+    return HttpTeepotReply(self.address,
+                           self.port,
+                           sys_log,
+                           bind_and_activate=False,
+                           log_client=self.log_client,
+                           keepalive_timeout=self.keepalive_timeout,
+                           keepalive_max=self.keepalive_max,
+                           reuse_port=self.workers > 0,
+                           limiter=limiter,
+                           max_connections=self.max_connections,
+                           log_sample=self.log_sample,
+                           log_aggregate=self.log_aggregate)
+
+  def setStatusBoard(self, status):
+    """Answer the status endpoint and share the states from a status board
+
+    The endpoint is served only by the responder of the main process,
+    because the workers cannot see the clients of the main process
+    @param[StatusBoard] status : the board which provide the JSON document
+    """
+    if not (self.status or self.share_state):
+      return
+    if self.workers:
+      sys_log.warning('The status endpoint and the state sharing are not'
+                      + ' available with workers')
+      return
+    if self.status:
+      self.http.setRoute('/status', status.getJSON, 'application/json')
+    if self.share_state:
+      self.http.setHeaderProvider(status.getStateHeader)
+
+  def setInboundTracker(self, inbound):
+    """Record the queries received from watched hosts
+
+    The queries received by workers cannot be seen by the clients of the
+    main process, so nothing is recorded with workers
+    @param[InboundTracker] inbound : the tracker in which record queries
+    """
+    if self.workers:
+      sys_log.warning('Passive observations are not available with workers')
+      return
+    self.http.setObserver(inbound.record)
+
+  def setGossip(self, gossip):
+    """Answer the gossip endpoint from which peers pull the states
+
+    @param[Gossip] gossip : the gossip instance which provide the deltas
+    """
+    if self.workers:
+      sys_log.warning('The gossip endpoint is not available with workers')
+      return
+    self.http.setRoute(gossip.PATH, gossip.getDelta, 'application/json',
+                       query=True)
+
+  def setElection(self, election):
+    """Answer the lease endpoint on which nodes ask the leadership
+
+    @param[LeaderElection] election : the election which grant the lease
+    """
+    if self.workers:
+      sys_log.warning('The lease endpoint is not available with workers')
+      return
+    self.http.setRoute(election.PATH, election.getLease, 'application/json',
+                       query=True)
+
+  def setMetrics(self, metrics):
+    """Answer the metrics endpoint from a metrics registry
+
+    The server counters are added to the registry. As the status endpoint,
+    it is served only by the responder of the main process
+    @param[Metrics] metrics : the registry which provide the document
+    """
+    if not self.metrics:
+      return
+    if self.workers:
+      sys_log.warning('The metrics endpoint is not available with workers')
+      return
+    metrics.setSource('server', self.http)
+    self.http.setRoute('/metrics', metrics.render,
+                       'text/plain; version=0.0.4')
+
   def open(self):
     """Bind network socket
 
@@ -88,8 +224,9 @@ class Server(Thread):
 
     # Open socket separatly for checking bind permissions
     try:
-      self.http.server_bind()
-      self.http.server_activate()
+      for http in (self.__l_worker_http or [self.http]):
+        http.server_bind()
+        http.server_activate()
     except Error:
       sys_log.error("Unable to open socket on port %s", self.port)
       return False
@@ -100,11 +237,74 @@ class Server(Thread):
                   self.port)
     return True
 
+  def spawn(self):
+    """Fork the responder worker processes
+
+    Each worker serve one of the listening sockets opened by open(), so this
+    must be called after the privilege downgrade and before starting threads
+    @return[boolean] : True if all workers have been started
+                        False otherwise
+    """
+    for http in self.__l_worker_http:
+      try:
+        pid = os.fork()
+      except OSError as e:
+        sys_log.error('Unable to fork responder worker: %s', e)
+        return False
+      if pid == 0:
+        self.__serveWorker(http)
+      sys_log.debug('Started responder worker %d', pid)
+      self.__l_worker_pid.append(pid)
+      # the socket is now owned by the worker
+      http.server_close()
+    return True
+
+  def __serveWorker(self, http):
+    """Run the event loop of a worker process and exit it
+
+    @param[HttpTeepotReply] http : the server instance to serve
+    """
+    status = 0
+    try:
+      handler = lambda signum, frame: http.shutdown()
+      signal.signal(signal.SIGTERM, handler)
+      signal.signal(signal.SIGINT, handler)
+      for other in self.__l_worker_http:
+        if other is not http:
+          other.server_close()
+      http.serve()
+      http.server_close()
+    except BaseException as e:
+      sys_log.error('Responder worker failure: %s', e)
+      status = 1
+    finally:
+      logging.shutdown()
+      os._exit(status)
+
+  def __reapWorkers(self, block=False):
+    """Forget the worker processes which have exited
+
+    @param[boolean] block : if True wait for all workers to exit
+    """
+    for pid in list(self.__l_worker_pid):
+      try:
+        if os.waitpid(pid, 0 if block else os.WNOHANG)[0] == 0:
+          continue
+      except ChildProcessError:
+        pass
+      if not self.__event_stop.isSet():
+        sys_log.error('Responder worker %d has exited', pid)
+      self.__l_worker_pid.remove(pid)
+
   def close(self):
     """Close network socket
     """
+    http = self.getServerInstance()
+    if http is None or http.isClosed():
+      # the socket is owned by a worker process
+      return
     try:
-      self.getServerInstance().socket.close()
+      http.server_close()
       sys_log.debug('Closing local server socket')
     except Error:
       sys_log.error('Unable to close server socket')
@@ -116,12 +316,30 @@ class Server(Thread):
 
   def run(self):
     """Run the thread
+
+    The server event loop run until stop() is called
     """
     http = self.getServerInstance()
-    while not self.__event_stop.isSet():
-      http.timeout = 0.5
-      http.handle_request()
-      self.__event_stop.wait(0.5)
+    if self.__l_worker_http:
+      while not self.__event_stop.wait(1):
+        self.__reapWorkers()
+      self.__reapWorkers(block=True)
+    elif not self.__event_stop.isSet():
+      http.serve()
 
     # close the socket
     self.close()
+
+  def stop(self):
+    """Wake up the server event loop and make it exit
+
+    Workers are asked to exit by SIGTERM
+    """
+    for pid in self.__l_worker_pid:
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except ProcessLookupError:
+        pass
+    http = self.getServerInstance()
+    if http and not http.isClosed():
+      http.shutdown()
@@ -0,0 +1,151 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/sharding module
+
+It provide the assignment of the supervised hosts to the nodes of the
+cluster by consistent hashing
+"""
+
+# System imports
+from bisect import bisect
+import hashlib
+
+# Projet Imports
+
+
+class HashRing:
+  """A consistent hash ring of nodes
+
+  Each node is placed at several points of the ring, so when a node leaves
+  only the keys it owned move to other nodes
+  """
+
+  # number of points of each node on the ring
+  VNODES = 64
+
+  def __init__(self, l_node):
+    """Constructor : Build the ring of a list of nodes
+
+    @param[list] l_node : the node names
+    """
+    self.l_node = sorted(set(l_node))
+    l_point = []
+    for node in self.l_node:
+      for i in range(self.VNODES):
+        l_point.append((self._hash(node + '#' + str(i)), node))
+    l_point.sort()
+    self._l_hash = [h for h, node in l_point]
+    self._l_point = [node for h, node in l_point]
+
+  def getOwners(self, key, count):
+    """Return the nodes which own a key
+
+    @param[string] key : the key
+    @param[int] count : the number of owners
+    @return[list] : the first distinct nodes found clockwise from the key
+    """
+    l_owner = []
+    if not self._l_point:
+      return l_owner
+    count = min(count, len(self.l_node))
+    i = bisect(self._l_hash, self._hash(key))
+    while len(l_owner) < count:
+      node = self._l_point[i % len(self._l_point)]
+      if node not in l_owner:
+        l_owner.append(node)
+      i += 1
+    return l_owner
+
+  @staticmethod
+  def _hash(value):
+    """Return the position of a value on the ring
+
+    The hash must be the same on all nodes, so the builtin hash() which is
+    randomized by process cannot be used
+    @param[string] value : the value
+    @return[int] : the position
+    """
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ProbeSharding:
+  """Assign each host to 'replicas' alive nodes of the cluster
+
+  The alive nodes are given by the gossip heartbeats, the ring is rebuilt
+  only when this list changes
+  """
+
+  def __init__(self, gossip, replicas):
+    """Constructor : Build the sharding of a cluster
+
+    @param[Gossip] gossip : the gossip instance which know the alive nodes
+    @param[int] replicas : the number of nodes which probe each host
+    """
+    self.__gossip = gossip
+    self.replicas = max(1, replicas)
+    self.__ring = HashRing([gossip.node])
+
+  def getOwners(self, name):
+    """Return the nodes which must probe a host
+
+    @param[string] name : the client name
+    @return[list] : the node names
+    """
+    l_node = self.__gossip.getAliveNodes()
+    ring = self.__ring
+    if ring.l_node != l_node:
+      ring = HashRing(l_node)
+      self.__ring = ring
+    return ring.getOwners(name, self.replicas)
+
+  def isOwner(self, name):
+    """Return True if this node must probe a host
+
+    @param[string] name : the client name
+    """
+    return self.__gossip.node in self.getOwners(name)
+
+  def isPrimary(self, name):
+    """Return True if this node is the first owner of a host
+
+    Only the first owner dispatch the triggers of the host
+    @param[string] name : the client name
+    """
+    l_owner = self.getOwners(name)
+    return bool(l_owner) and l_owner[0] == self.__gossip.node
+
+  def getOwnerState(self, name):
+    """Return the last state change observed by the owners of a host
+
+    @param[string] name : the client name
+    @return[int] : the state
+                   None if no owner has shared the state of the host
+    """
+    d_observation = self.__gossip.getObservations(name)
+    l_state = [d_observation[node] for node in self.getOwners(name)
+               if node in d_observation]
+    if not l_state:
+      return None
+    return max(l_state, key=lambda o: o[1])[0]
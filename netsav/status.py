@@ -0,0 +1,164 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/status module
+
+It provide the board on which clients publish their state for the status
+endpoint of the server
+"""
+
+# System imports
+import itertools
+import json
+import socket
+import time
+from urllib.parse import quote, unquote
+
+# Projet Imports
+
+
+class StatusBoard:
+  """A copy-on-write board of the client states
+
+  Each client publish a new entry dict which is never modified after, so
+  publishing is a single dict item assignment and does not need any lock.
+  The JSON document is built from a shallow copy of the entries, only when
+  a different entry has been published or the references state has changed
+  since the last build
+  The compact state header sent to peers in the server replies is built the
+  same way, only when the state of a client has changed
+  """
+
+  # name of the response header which contains the compact states
+  STATE_HEADER = 'X-Netsav-State'
+  # maximum size of the header value, clients which do not fit are omitted
+  STATE_HEADER_SIZE = 4096
+
+  def __init__(self, active=None):
+    """Constructor : Build an empty board
+
+    @param[threading.Event] active : the event set while all references are up
+    """
+    self._active = active
+    self._d_entry = dict()
+    self._counter = itertools.count(1)
+    # version of the published entries and of the client states
+    self._version = 0
+    self._state_version = 0
+    self._updated = None
+    # key of the built document and the document
+    self._body_key = None
+    self._body = None
+    # version of the built state header and the header
+    self._header_version = None
+    self._header = None
+
+  def publish(self, name, entry):
+    """Replace the entry of a client
+
+    @param[string] name : the client name
+    @param[dict] entry : the client entry, it must not be modified after
+    """
+    previous = self._d_entry.get(name)
+    if previous == entry:
+      return
+    self._d_entry[name] = entry
+    self._updated = time.time()
+    self._version = next(self._counter)
+    if previous is None or previous['state'] != entry['state']:
+      self._state_version = self._version
+
+  def getEntries(self):
+    """Return a snapshot of all entries
+
+    @return[dict] : the entries by client name
+    """
+    return dict(self._d_entry)
+
+  def getVersion(self):
+    """Return the version of the board, it change when an entry changes
+
+    @return[int] : the version number
+    """
+    return self._version
+
+  def getJSON(self):
+    """Return the JSON document of the board
+
+    @return[bytes] : the encoded document
+    """
+    key = (self._version,
+           self._active is None or self._active.is_set())
+    if key != self._body_key:
+      doc = dict()
+      doc['hostname'] = socket.gethostname()
+      doc['updated'] = self._updated
+      doc['active'] = key[1]
+      doc['clients'] = self.getEntries()
+      self._body = json.dumps(doc, sort_keys=True).encode('utf-8')
+      self._body_key = key
+    return self._body
+
+  def getStateHeader(self):
+    """Return the response header line which contains the compact states
+
+    The value is made of the hostname, the board version and the comma
+    separated list of quoted client name and state
+    @return[bytes] : the encoded header line with its line ending
+    """
+    version = self._state_version
+    if version != self._header_version:
+      value = socket.gethostname() + ' ' + str(version) + ' '
+      l_item = []
+      size = len(value)
+      for name, entry in sorted(self.getEntries().items()):
+        item = quote(name, safe='') + ':' + str(entry['state'])
+        size += len(item) + 1
+        if size > self.STATE_HEADER_SIZE:
+          break
+        l_item.append(item)
+      value += ','.join(l_item)
+      self._header = (self.STATE_HEADER + ': ' + value + '\r\n').encode('utf-8')
+      self._header_version = version
+    return self._header
+
+  @staticmethod
+  def parseStateHeader(value):
+    """Decode the value of a state header
+
+    @param[string] value : the header value
+    @return[tuple] : the hostname, the board version and the dict of states
+                      by client name
+                     None if the value is invalid
+    """
+    try:
+      node, version, items = (value.strip().split(' ') + [''])[:3]
+      d_state = dict()
+      for item in items.split(','):
+        if item:
+          name, state = item.rsplit(':', 1)
+          d_state[unquote(name)] = int(state)
+      return (node, int(version), d_state)
+    except ValueError:
+      return None
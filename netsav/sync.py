@@ -106,6 +106,18 @@ class Sync:
         sys_log.info('[' + name + '] Reference is down')
     self._lock_counter.release()
 
+  def getStats(self):
+    """Return the reference counters
+
+    @return[dict] : the number of 'references', the number of
+                    'references_down' and the 'active' state of the
+                    non-ref clients
+    """
+    with self._lock_counter:
+      return {'references': self._counter_ref,
+              'references_down': self._counter_ref_down,
+              'active': self._active.is_set()}
+
   def increaseDownCounter(self):
     """Increase the internal down reference counter
 
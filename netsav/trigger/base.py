@@ -23,8 +23,10 @@
 # SOFTWARE.
 
 # System imports
+import asyncio
 
 # Projet Imports
+from ..asyncrunner import acquire
 
 
 class TriggerHandler:
@@ -32,6 +34,9 @@ class TriggerHandler:
 
   All trigger are executed consecutively by the main thread who is different
   from client(s) and server thread
+  A trigger which does network operations can implement do() and do_batch()
+  as coroutines (async def), they are then run concurrently on a dedicated
+  event loop, with a timeout given by the 'do_timeout' option
 
   The constructor must initialise some needed attribut but didn't receive any
   parameter
@@ -60,6 +65,95 @@ class TriggerHandler:
         return self._config['name']
     return 'unknown'
 
+  def getDigestWindow(self):
+    """Return the digest window of this trigger in seconds
+
+    This is an accessor for netsav module
+    All events received during this window are delivered together by a
+    single call to do_batch(). It is read from the 'digest_window' option
+    @return[int] the window in seconds, 0 if digest is disabled
+    """
+    return self._getIntOption('digest_window', 0)
+
+  def getRetry(self):
+    """Return the number of retry for a failed event
+
+    This is an accessor for netsav module
+    When do() or do_batch() fail, the event is given again to the trigger
+    after an exponential delay. It is read from the 'retry' option
+    @return[int] the maximum number of retry, 0 by default
+    """
+    return self._getIntOption('retry', 0)
+
+  def getRetryDelay(self):
+    """Return the delay range between two retry in seconds
+
+    This is an accessor for netsav module
+    The delay before the first retry is read from the 'retry_delay' option,
+    it is doubled at each retry up to the 'retry_max_delay' option
+    @return[tuple] the (first delay, maximum delay) pair
+    """
+    return (self._getIntOption('retry_delay', 5),
+            self._getIntOption('retry_max_delay', 300))
+
+  def getDoTimeout(self):
+    """Return the maximum running time of a coroutine do() in seconds
+
+    This is an accessor for netsav module
+    It is read from the 'do_timeout' option, it only apply to the triggers
+    which implement do() or do_batch() as coroutines. The time spent waiting
+    for a concurrency slot in _acquire() is not counted
+    @return[int] the timeout in seconds, 0 for no timeout
+    """
+    return self._getIntOption('do_timeout', 30)
+
+  def _acquire(self, semaphore):
+    """Return an async context manager which hold a concurrency slot
+
+    Use it as 'async with self._acquire(semaphore):' in a coroutine do(),
+    so the events which only wait for a slot are not timed out
+    @param[asyncio.Semaphore] semaphore : the semaphore which bound concurrency
+    @return[object] the async context manager
+    """
+    return acquire(semaphore)
+
+  def getRoutes(self):
+    """Return the routing rules of this trigger
+
+    This is an accessor for netsav module
+    The rules are read from the 'route_client', 'route_tag', 'route_state'
+    and 'route_group' options, each one is a comma separated list of shell
+    patterns. Only the events which match all defined rules are given
+    to this trigger
+    @return[dict] the list of patterns indexed by rule name
+                  ('client', 'tag', 'state', 'group')
+    """
+    routes = dict()
+    if not self._config:
+      return routes
+    for rule in ['client', 'tag', 'state', 'group']:
+      option = self._config.get('route_' + rule)
+      if option:
+        routes[rule] = [p.strip() for p in option.split(',') if p.strip()]
+    return routes
+
+  def _getIntOption(self, option, default):
+    """Return a positive integer option from the configuration dict
+
+    @param[string] option : the option name without the trigger prefix
+    @param[int] default : the value to return if option is not defined
+    @return[int] the option value
+    """
+    if self._config and option in self._config:
+      try:
+        return max(0, int(self._config[option]))
+      except ValueError:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" has an invalid ' + option + ' value')
+        self._config[option] = default
+    return default
+
   def setLogger(self, logger):
     """Use to set a internal logger for this trigger
 
@@ -93,15 +187,54 @@ class TriggerHandler:
     API for netsav module
     The return value of this function will be looked and some log will be
     generated if the result is False
+    It can be declared as a coroutine with 'async def'
     This function is called each time an event happen. All event contain
     a set of information about what happen in a python dict. They are available
     by these key :
     'name', 'address', 'port', 'interval', 'min_retry',
      'max_retry', 'tcp_timeout', 'current_state', 'current_state_str',
-     'previous_state', 'previous_state_str', 'msg', 'brief', 'tag'
+     'previous_state', 'previous_state_str', 'group', 'msg', 'brief', 'tag'
     @param[dict] value : the dict which contains the key value refer to this
                           event
     @return[boolean] :  True if execution success
                         False otherwise
     """
     raise NotImplementedError('do(value)')
+
+  def do_batch(self, values):
+    """(Optional overload)The called function when a digest of events must be
+    trigged by this
+
+    API for netsav module
+    This function is called instead of do() when a digest window is set for
+    this trigger. It receive all events that arrive during the window, so a
+    trigger can render them as a single notification.
+    The default implementation call do() for each event
+    @param[list] values : the list of event dict in their arrival order
+    @return[boolean|list] : True if execution success
+                            False otherwise
+                            or the list of result of each event, so only
+                            the failed events are given again
+    """
+    if asyncio.iscoroutinefunction(self.do):
+      return self._do_batch_async(values)
+    return [bool(self.do(value)) for value in values]
+
+  async def _do_batch_async(self, values):
+    """Default do_batch() implementation for coroutine do()
+
+    All events are handled concurrently
+    @param[list] values : the list of event dict in their arrival order
+    @return[list] : the result of each event
+    """
+    l_result = await asyncio.gather(*[self.do(value) for value in values])
+    return [bool(result) for result in l_result]
+
+  def close(self):
+    """(Optional overload)Release all resources hold by this trigger
+
+    API for netsav module
+    This function is called once when netsav stop, after all remaining
+    events have been delivered
+    """
+    pass
@@ -0,0 +1,158 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# System imports
+import asyncio
+import json
+import os
+import shlex
+import signal
+import socket
+
+
+# Projet Imports
+from .base import TriggerHandler
+
+
+class Trigger(TriggerHandler):
+  """An exec trigger which run a command for each event
+
+  The event fields are given to the command as environment variables and/or
+  as a json object on its standard input. Commands run as subprocesses of the
+  trigger event loop, so they never block netsav. The number of concurrent
+  commands is bounded, and a command which overruns its timeout is killed
+  with all the processes of its session
+  """
+
+  INPUTS = ['env', 'json', 'both']
+  # prefix of the environment variables which contain event fields
+  ENV_PREFIX = 'NETSAV_'
+
+  def __init__(self):
+    """(override)Default constructor:
+    """
+    TriggerHandler.__init__(self)
+    # the command as a list of arguments
+    self.__l_command = None
+    # the semaphore which bound concurrency, created in the event loop
+    self.__semaphore = None
+
+  def load(self):
+    """Load configuration from conf file
+
+    The return value of this function determine if the trigger must
+    be loaded or not. If this return false, the trigger will not be use
+    @return[boolean] :  True if load success
+                        False otherwise
+    """
+    config = self._config
+    if 'command' not in config:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() + '" need a command')
+      return False
+    try:
+      self.__l_command = shlex.split(config['command'])
+    except ValueError as e:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() +
+                           '" has an invalid command: ' + str(e))
+      return False
+    if not self.__l_command:
+      return False
+
+    if 'input' not in config:
+      config['input'] = 'env'
+    if config['input'] not in self.INPUTS:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() +
+                           '" input must be in ' + str(self.INPUTS))
+      return False
+
+    for opt, default in [('timeout', 10), ('concurrency', 4)]:
+      try:
+        config[opt] = max(1, int(config.get(opt, default)))
+      except ValueError:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" need a number for ' + opt)
+        return False
+    return True
+
+  async def do(self, value=None):
+    """Run the command for one event
+
+    @return(boolean) :  True if the command has exited with code 0
+                        False otherwise
+    """
+    if not value:
+      return False
+    if self.__semaphore is None:
+      self.__semaphore = asyncio.Semaphore(self._config['concurrency'])
+
+    conf = self._config
+    env = None
+    stdin = None
+    data = None
+    if conf['input'] in ['env', 'both']:
+      env = dict(os.environ)
+      env[self.ENV_PREFIX + 'HOSTNAME'] = socket.gethostname()
+      for key in value:
+        env[self.ENV_PREFIX + key.upper()] = str(value[key])
+    if conf['input'] in ['json', 'both']:
+      stdin = asyncio.subprocess.PIPE
+      data = json.dumps(value, default=str).encode('utf-8')
+
+    async with self._acquire(self.__semaphore):
+      proc = await asyncio.create_subprocess_exec(
+          *self.__l_command,
+          stdin=stdin,
+          stdout=asyncio.subprocess.DEVNULL,
+          stderr=asyncio.subprocess.PIPE,
+          env=env,
+          start_new_session=True)
+      try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(data),
+                                                conf['timeout'])
+      except asyncio.TimeoutError:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() + '" command ' +
+                             'killed after ' + str(conf['timeout']) + 's')
+        return False
+      finally:
+        # kill an overrunning or cancelled command with all its children
+        if proc.returncode is None:
+          try:
+            os.killpg(proc.pid, signal.SIGKILL)
+          except ProcessLookupError:
+            pass
+          await proc.wait()
+
+    if proc.returncode != 0:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() +
+                           '" command exited with code ' +
+                           str(proc.returncode) + ': ' +
+                           stderr.decode('utf-8', 'replace').strip())
+      return False
+    return True
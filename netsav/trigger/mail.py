@@ -27,6 +27,7 @@ from email.mime.text import MIMEText
 import smtplib
 from socket import error as socket_error
 import socket
+import time
 
 
 # Projet Imports
@@ -38,11 +39,17 @@ class Trigger(TriggerHandler):
   """
   # value considered as True in the config file
   BOOL_TRUE_MAP = ['true', 'TRUE', 'True', '1']
+  # smtp reply code sent by server when it close the session
+  SMTP_CLOSING_CODE = 421
 
   def __init__(self):
     """(override)Default constructor:
     """
     TriggerHandler.__init__(self)
+    # the current authenticated smtp session
+    self.__smtp = None
+    # the time of the last use of the smtp session
+    self.__last_use = 0
 
   def load(self):
     """Load configuration from conf file
@@ -60,7 +67,9 @@ class Trigger(TriggerHandler):
       return False
 
     if 'start_tls' not in config:
-      config['start_tls'] = false
+      config['start_tls'] = 'false'
+    if 'ssl' not in config:
+      config['ssl'] = 'false'
 
     # check username and password
     if 'auth' in config:
@@ -72,7 +81,17 @@ class Trigger(TriggerHandler):
                              '" need a username and password for auth')
         return False
     else:
-      config['auth'] = false
+      config['auth'] = 'false'
+
+    # check network timeout and session keepalive
+    for opt, default in [('timeout', 1), ('keepalive', 60)]:
+      try:
+        config[opt] = float(config.get(opt, default))
+      except ValueError:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" need a number of seconds for ' + opt)
+        return False
 
     if 'tag' not in config:
       config['tag'] = 'NETSAV'
@@ -92,41 +111,129 @@ class Trigger(TriggerHandler):
     if not value or not self._config:
       return False
 
-    conf = self._config
-    try:
-      if conf['ssl'] in self.BOOL_TRUE_MAP:
-        m = smtplib.SMTP_SSL(host=conf['server'],
-                             port=conf['port'],
-                             timeout=1)
-      else:
-        m = smtplib.SMTP(host=conf['server'],
-                         port=conf['port'],
-                         timeout=1)
-    except socket_error as e:
-      if self._logger:
-        self._logger.error('Trigger "' + self.getName() +
-                           '" unable to connect to ' +
-                           conf['server'] + ':' + conf['port'])
-      return False
-
-    if conf['start_tls'] in self.BOOL_TRUE_MAP:
-      m.starttls()
-    if conf['auth'] in self.BOOL_TRUE_MAP:
-      m.login(conf['username'], conf['password'])
-
-    subject = '[' + socket.gethostname() + '][' + conf['tag'] + ']'
+    subject = '[' + socket.gethostname() + '][' + self._config['tag'] + ']'
     if 'tag' in value:
       subject += '[' + value['tag'] + ']'
     if 'brief' in value:
       subject += ' ' + value['brief']
+    return self.__send(subject, value['msg'])
 
-    body = conf['body'].replace('\\n', '\n').format(message=value['msg'])
+  def do_batch(self, values):
+    """(override)Send all events received during the digest window in one mail
+
+    @param[list] values : the list of event dict
+    @return(boolean) :  True if handle success
+                        False otherwise
+    """
+    if not values or not self._config:
+      return False
+    if len(values) == 1:
+      return self.do(values[0])
+
+    subject = ('[' + socket.gethostname() + '][' + self._config['tag'] + ']' +
+               ' Digest of ' + str(len(values)) + ' events')
+    lines = []
+    for value in values:
+      line = ''
+      if 'tag' in value:
+        line += '[' + value['tag'] + '] '
+      lines.append(line + value['msg'])
+    return self.__send(subject, '\n'.join(lines))
+
+  def close(self):
+    """(override)Close the smtp session if it is opened
+    """
+    if self.__smtp is None:
+      return
+    try:
+      self.__smtp.quit()
+    except (socket_error, smtplib.SMTPException):
+      pass
+    finally:
+      self.__smtp = None
+
+  def __getSession(self):
+    """Return an authenticated smtp session
+
+    The current session is reused unless it has been idle for more than the
+    keepalive delay, in this case a new one is opened
+    @return(smtplib.SMTP) : the smtp session
+    """
+    conf = self._config
+    if (self.__smtp is not None and
+        time.monotonic() - self.__last_use > conf['keepalive']):
+      self.close()
+    if self.__smtp is not None:
+      return self.__smtp
+
+    if conf['ssl'] in self.BOOL_TRUE_MAP:
+      m = smtplib.SMTP_SSL(host=conf['server'],
+                           port=conf['port'],
+                           timeout=conf['timeout'])
+    else:
+      m = smtplib.SMTP(host=conf['server'],
+                       port=conf['port'],
+                       timeout=conf['timeout'])
+    try:
+      if conf['start_tls'] in self.BOOL_TRUE_MAP:
+        m.starttls()
+      if conf['auth'] in self.BOOL_TRUE_MAP:
+        m.login(conf['username'], conf['password'])
+    except:
+      m.close()
+      raise
+    self.__smtp = m
+    return m
+
+  def __send(self, subject, message):
+    """Build and send a mail to the configured recipients
+
+    The smtp session is kept opened between two mails, if the server has
+    closed it meanwhile a new session is opened transparently
+    @param(string) subject : the mail subject
+    @param(string) message : the message to put in the body
+    @return(boolean) :  True if send success
+                        False otherwise
+    """
+    conf = self._config
+    body = conf['body'].replace('\\n', '\n').format(message=message)
 
     # Building mail
     msg = MIMEText(body)
     msg['Subject'] = subject
     msg['From'] = conf['sender']
     msg['To'] = conf['recipient']
-    m.sendmail(conf['sender'], conf['recipient'].split(','), msg.as_string())
-    m.quit()
+
+    # a reused session may have been closed by the server, retry once
+    for retry in [True, False]:
+      try:
+        m = self.__getSession()
+      except socket_error as e:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" unable to connect to ' +
+                             conf['server'] + ':' + conf['port'])
+        return False
+      try:
+        m.sendmail(conf['sender'],
+                   conf['recipient'].split(','),
+                   msg.as_string())
+        break
+      except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+        # the connection is lost, release the socket without sending QUIT
+        m.close()
+        self.__smtp = None
+        if not retry:
+          raise
+      except smtplib.SMTPResponseException as e:
+        self.close()
+        if not retry or e.smtp_code != self.SMTP_CLOSING_CODE:
+          raise
+      if self._logger:
+        self._logger.debug('Trigger "' + self.getName() +
+                           '" smtp session closed by server, reconnecting')
+
+    self.__last_use = time.monotonic()
+    if conf['keepalive'] <= 0:
+      self.close()
     return True
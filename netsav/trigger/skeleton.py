@@ -64,7 +64,7 @@ class Trigger(TriggerHandler):
     by these key :
     'name', 'address', 'port', 'interval', 'min_retry',
      'max_retry', 'tcp_timeout', 'current_state', 'current_state_str',
-     'previous_state', 'previous_state_str', 'msg', 'brief', 'tag'
+     'previous_state', 'previous_state_str', 'group', 'msg', 'brief', 'tag'
     @param[dict] value : the dict which contains the key value refer to this
                           event
     @return[boolean] :  True if execution success
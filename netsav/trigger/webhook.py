@@ -0,0 +1,196 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# System imports
+import asyncio
+from collections import deque
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+import json
+import socket
+from urllib.parse import urlsplit
+
+
+# Projet Imports
+from .base import TriggerHandler
+
+
+class Trigger(TriggerHandler):
+  """A webhook trigger which post events as json to an http(s) url
+
+  Requests are made through a pool of keep-alive connections, the size of
+  the pool bounds the number of concurrent requests. Events which arrive
+  together are posted in one request
+  """
+
+  def __init__(self):
+    """(override)Default constructor:
+    """
+    TriggerHandler.__init__(self)
+    # the parsed url
+    self.__url = None
+    # idle keep-alive connections
+    self.__l_conn = deque()
+    # the semaphore which bound concurrency, created in the event loop
+    self.__semaphore = None
+
+  def load(self):
+    """Load configuration from conf file
+
+    The return value of this function determine if the trigger must
+    be loaded or not. If this return false, the trigger will not be use
+    @return[boolean] :  True if load success
+                        False otherwise
+    """
+    config = self._config
+    if 'url' not in config:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() + '" need an url')
+      return False
+    self.__url = urlsplit(config['url'])
+    if self.__url.scheme not in ['http', 'https'] or not self.__url.hostname:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() +
+                           '" need an http or https url')
+      return False
+
+    for opt, default in [('timeout', 5), ('concurrency', 4),
+                         ('batch_size', 50)]:
+      try:
+        config[opt] = max(1, int(config.get(opt, default)))
+      except ValueError:
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" need a number for ' + opt)
+        return False
+
+    # group the events which arrive together
+    if 'digest_window' not in config:
+      config['digest_window'] = 1
+    return True
+
+  async def do(self, value=None):
+    """Post one event
+
+    @return(boolean) :  True if handle success
+                        False otherwise
+    """
+    if not value:
+      return False
+    return await self.__post([value])
+
+  async def do_batch(self, values):
+    """(override)Post all events received together, by requests of at most
+    batch_size events
+
+    @param[list] values : the list of event dict
+    @return(list) : the result of each event, the events of a request
+                    share its result
+    """
+    size = self._config['batch_size']
+    l_result = await asyncio.gather(*[self.__post(values[i:i + size])
+                                      for i in range(0, len(values), size)])
+    return [l_result[i // size] for i in range(len(values))]
+
+  def close(self):
+    """(override)Close all idle connections
+    """
+    while self.__l_conn:
+      self.__l_conn.pop().close()
+
+  async def __post(self, values):
+    """Post a list of events using a connection of the pool
+
+    @param[list] values : the list of event dict
+    @return(boolean) :  True if the server has answered with a 2xx code
+                        False otherwise
+    """
+    if self.__semaphore is None:
+      self.__semaphore = asyncio.Semaphore(self._config['concurrency'])
+    body = json.dumps({'host': socket.gethostname(),
+                       'events': values},
+                      default=str).encode('utf-8')
+
+    async with self._acquire(self.__semaphore):
+      if self.__l_conn:
+        conn = self.__l_conn.pop()
+      else:
+        conn = self.__connect()
+      loop = asyncio.get_event_loop()
+      try:
+        status = await loop.run_in_executor(None, self.__request, conn, body)
+      except (OSError, HTTPException) as e:
+        conn.close()
+        if self._logger:
+          self._logger.error('Trigger "' + self.getName() +
+                             '" unable to post to ' + self._config['url'] +
+                             ': ' + str(e))
+        return False
+      self.__l_conn.append(conn)
+
+    if status < 200 or status >= 300:
+      if self._logger:
+        self._logger.error('Trigger "' + self.getName() + '" ' +
+                           self._config['url'] + ' answered ' + str(status))
+      return False
+    return True
+
+  def __connect(self):
+    """Build a new connection to the webhook server
+
+    @return(HTTPConnection) : the connection, it is opened on first request
+    """
+    if self.__url.scheme == 'https':
+      cls = HTTPSConnection
+    else:
+      cls = HTTPConnection
+    return cls(self.__url.hostname,
+               self.__url.port,
+               timeout=self._config['timeout'])
+
+  def __request(self, conn, body):
+    """Send a post request, this is run in an executor thread
+
+    A keep-alive connection closed by the server is reopened once
+    @param(HTTPConnection) conn : the connection to use
+    @param(bytes) body : the json body
+    @return(int) : the http status code
+    """
+    path = self.__url.path or '/'
+    if self.__url.query:
+      path += '?' + self.__url.query
+    headers = {'Content-Type': 'application/json',
+               'Connection': 'keep-alive'}
+    for retry in [True, False]:
+      try:
+        conn.request('POST', path, body, headers)
+        res = conn.getresponse()
+        # read the whole response to be able to reuse the connection
+        res.read()
+        if res.will_close:
+          conn.close()
+        return res.status
+      except ConnectionError:
+        conn.close()
+        if not retry:
+          raise
@@ -23,16 +23,55 @@
 # SOFTWARE.
 
 # System imports
+import asyncio
+import heapq
+import inspect
+import itertools
 import logging
-from queue import Queue
+from queue import Empty
+import random
+import threading
+import time
 
 # Projet Imports
+from .asyncrunner import AsyncRunner
+from .client.client import Client
+from .deadletter import DeadLetterStore
+from .journal import Journal
+from .ratelimit import RateLimiter
+from .router import TriggerRouter
 from .trigger.base import TriggerHandler
+from .triggerqueue import TriggerQueue
 
 # Global project declarations
 sys_log = logging.getLogger('netsav')
 
 
+class TriggerEvent:
+  """Internal container of a queued trigger event
+
+  It keep the event value with all informations needed to handle it
+  """
+
+  def __init__(self, value, event_id=None, targets=None):
+    """Constructor : Build a queued event
+
+    @param[dict] value : the event value given to triggers
+    @param[int] event_id : the identifier of the event in the journal
+    @param[set] targets : the names of triggers which must handle this event
+                          None for all triggers
+    """
+    self.value = value
+    self.id = event_id
+    self.targets = targets
+    # the priority level of this event, 0 is the most important
+    self.priority = 0
+    # names of triggers which have not handled this event yet
+    self.remaining = None
+    # the time at which the event has been queued
+    self.time = time.monotonic()
+
+
 class TriggerLoader:
   """Trigger loading class
 
@@ -41,15 +80,50 @@ class TriggerLoader:
   to the respective trigger class during instanciation
   """
 
+  # event priority classes, from the most important to the least one
+  #  critical : an event about a reference client
+  #  down : a client which become unavailable
+  #  up : a client which become available
+  #  info : all other events
+  PRIORITY_CLASSES = ['critical', 'down', 'up', 'info']
+
   def __init__(self):
     """Constructor : Build a trigger loader object
     """
     # Config object
     self.cp = None
     # Initialize queue
-    self.__queue = Queue()
+    self.__queue = TriggerQueue()
     # list of trigger object for handling
     self.__l_trigger = []
+    # routing table which select the triggers of each event
+    self.__router = TriggerRouter()
+    # pending digest batches indexed by trigger object
+    #  each entry is a [deadline, list of event] pair
+    self.__d_digest = dict()
+    # the durable event journal if configured
+    self.__journal = None
+    # retry timer heap of (due time, sequence, trigger, events, batch, attempt)
+    self.__l_retry = []
+    self.__retry_seq = itertools.count()
+    # event loop of coroutine triggers
+    self.__runner = AsyncRunner(self.__queue.interrupt)
+    # events which have failed after all their retries
+    self.__dead_letter = DeadLetterStore()
+    # per client rate limiter and the suppressed events
+    #  indexed by client name, each entry is a [counter, last value] pair
+    self.__ratelimit = None
+    self.__d_suppressed = dict()
+    self.__lock_suppressed = threading.Lock()
+    # priority level of each priority class
+    self.__d_priority = dict()
+    for level, name in enumerate(self.PRIORITY_CLASSES):
+      self.__d_priority[name] = level
+    # dispatch counters
+    self.__counter_dispatch = 0
+    self.__age_sum = 0.0
+    self.__age_max = 0.0
+    self.__d_age_max = dict()
 
   def load(self, config_parser):
     """Load this trigger object with all defined trigger
@@ -84,8 +158,13 @@ class TriggerLoader:
         t.setLogger(sys_log)
         t.setConfiguration(param)
         if t.load():
+          self.__router.add(t, t.getRoutes())
           self.__l_trigger.append(t)
           sys_log.debug('[TRIGGER] Loaded trigger ' + trig_name)
+          if t.getDigestWindow() > 0:
+            sys_log.debug('[TRIGGER] Trigger ' + trig_name +
+                          ' use a digest window of ' +
+                          str(t.getDigestWindow()) + 's')
         else:
           # loading error
           sys_log.error('[TRIGGER] Trigger "' + trig_name +
@@ -104,9 +183,89 @@ class TriggerLoader:
         sys_log.error('[TRIGGER] Trigger "' + trig_name +
                       '" has encounter an unknown error: ' + str(e))
 
+    if self.hasTrigger():
+      config = config_parser.getTriggerLoaderConfigDict()
+      self.__loadQueue(config)
+      if config['rate'] and config['rate'] > 0:
+        self.__ratelimit = RateLimiter(config['rate'] / 3600.0,
+                                       config['rate_burst'])
+      self.__loadJournal(config)
+      self.__dead_letter = DeadLetterStore(config['dead_letter'],
+                                           config['dead_letter_size'])
     # return false if no trigger have been loaded
     return self.hasTrigger()
 
+  def __loadQueue(self, config):
+    """Build the event queue according to configuration
+
+    @param[dict] config : the trigger loader configuration dict
+    """
+    capacity = config['queue_size']
+    if capacity is None or capacity < 0:
+      capacity = 0
+
+    # the classes which are not listed share the lowest level
+    l_class = []
+    for name in config['priority'].split(','):
+      name = name.strip()
+      if name not in self.PRIORITY_CLASSES:
+        sys_log.error('[TRIGGER] Unknown priority class "' + name +
+                      '", must be in ' + str(self.PRIORITY_CLASSES))
+      elif name not in l_class:
+        l_class.append(name)
+    self.__d_priority = dict()
+    for name in self.PRIORITY_CLASSES:
+      if name in l_class:
+        self.__d_priority[name] = l_class.index(name)
+      else:
+        self.__d_priority[name] = len(l_class)
+    levels = max(self.__d_priority.values()) + 1
+    aging = config['priority_aging'] or 0
+
+    try:
+      self.__queue = TriggerQueue(capacity,
+                                  config['queue_policy'],
+                                  config['dedup'],
+                                  levels,
+                                  aging)
+    except ValueError as e:
+      sys_log.error('[TRIGGER] ' + str(e) + ', must be in ' +
+                    str(TriggerQueue.POLICIES))
+      self.__queue = TriggerQueue(capacity,
+                                  dedup=config['dedup'],
+                                  levels=levels,
+                                  aging=aging)
+    self.__runner = AsyncRunner(self.__queue.interrupt)
+
+  def __loadJournal(self, config):
+    """Open the event journal and queue the events to replay
+
+    @param[dict] config : the trigger loader configuration dict
+    """
+    if not config['journal']:
+      return
+    self.__journal = Journal(config['journal'],
+                             config['journal_sync'],
+                             config['journal_compact'])
+    try:
+      l_pending = self.__journal.open()
+    except OSError as e:
+      sys_log.error('[TRIGGER] Unable to open journal ' + config['journal'] +
+                    ': ' + str(e))
+      self.__journal = None
+      return
+
+    names = set([t.getName() for t in self.__l_trigger])
+    for event_id, value, acks in l_pending:
+      targets = names - acks
+      if targets:
+        self.__put(TriggerEvent(value, event_id, targets))
+      else:
+        self.__journal.complete(event_id)
+    if self.__queue.qsize():
+      sys_log.info('[TRIGGER] Replaying ' + str(self.__queue.qsize()) +
+                   ' event(s) from journal')
+
   def hasTrigger(self):
     """Check if there is/are registered trigger
 
@@ -144,50 +303,427 @@ class TriggerLoader:
     if 'tag' not in value:
       value['tag'] = tag
 
+    if self.__ratelimit and not self.__allow(value):
+      sys_log.debug('[TRIGGER] Event suppressed by rate limit for client [' +
+                    value['name'] + ']')
+      return False
+    return self.__queueValue(value)
+
+  def __queueValue(self, value):
+    """Write an event value into the journal and queue it
+
+    @param(dict) value : the event value
+    @return(boolean) : True if event successfully queued
+                       False otherwise
+    """
+    event_id = None
+    if self.__journal:
+      event_id = self.__journal.append(value)
     sys_log.debug('[TRIGGER] Event queued for client [' +
                   value['name'] + ']')
-    self.__queue.put(value)
+    return self.__put(TriggerEvent(value, event_id))
+
+  def __allow(self, value):
+    """Check the rate limit of the client which has sent an event
+
+    A suppressed event is kept as the last known state of its client, it
+    will be queued with a notice of the number of suppressed events as soon
+    as the client rate limit allow it
+    @param(dict) value : the event value
+    @return(boolean) : True if the event can be queued
+                       False if it has been suppressed
+    """
+    name = value['name']
+    with self.__lock_suppressed:
+      if not self.__ratelimit.allow(name):
+        counter = self.__d_suppressed.get(name, [0, None])[0]
+        self.__d_suppressed[name] = [counter + 1, value]
+        return False
+      # this event is more recent than the suppressed ones,
+      # which are all discarded
+      if name in self.__d_suppressed:
+        counter = self.__d_suppressed.pop(name)[0]
+        self.__setSuppressed(value, counter)
     return True
 
+  def __releaseSuppressed(self, force=False):
+    """Queue the last suppressed event of clients whose rate limit allow it
+
+    @param(boolean) force : if True release all clients whatever their limit
+    """
+    if not self.__d_suppressed:
+      return
+    l_value = []
+    with self.__lock_suppressed:
+      for name in list(self.__d_suppressed):
+        if force or self.__ratelimit.allow(name):
+          counter, value = self.__d_suppressed.pop(name)
+          self.__setSuppressed(value, counter - 1)
+          l_value.append(value)
+    for value in l_value:
+      sys_log.info('[TRIGGER] Release suppressed events for client [' +
+                   value['name'] + ']')
+      self.__queueValue(value)
+
+  @staticmethod
+  def __setSuppressed(value, counter):
+    """Add a notice of the number of suppressed events to an event value
+
+    @param(dict) value : the event value which represent the latest state
+    @param(int) counter : the number of other suppressed events
+    """
+    if counter <= 0:
+      return
+    value['suppressed'] = counter
+    value['msg'] += ('\n' + str(counter) +
+                     ' more event(s) suppressed by rate limit')
+
+  def __put(self, event):
+    """Put an event in the queue and forget the events dropped by overflow
+
+    @param(TriggerEvent) event : the event to queue
+    @return(boolean) : True if the given event has been queued
+                       False if it has been dropped
+    """
+    event.priority = self.__d_priority[self.getPriorityClass(event.value)]
+    l_drop = self.__queue.put(event)
+    if l_drop is None:
+      sys_log.debug('[TRIGGER] Ignoring duplicate event for client [' +
+                    event.value['name'] + ']')
+      if self.__journal and event.id is not None:
+        self.__journal.complete(event.id)
+      return False
+    for e in l_drop:
+      sys_log.warning('[TRIGGER] Queue is full, drop event for client [' +
+                      e.value['name'] + ']')
+      if self.__journal and e.id is not None:
+        self.__journal.complete(e.id)
+    return event not in l_drop
+
+  @staticmethod
+  def getPriorityClass(value):
+    """Return the priority class of an event
+
+    @param(dict) value : the event value
+    @return(string) : the name of the class among PRIORITY_CLASSES
+    """
+    if value.get('reference'):
+      return 'critical'
+    state = value.get('current_state')
+    if state == Client.UNAVAILABLE:
+      return 'down'
+    if state == Client.AVAILABLE:
+      return 'up'
+    return 'info'
+
+  def getStats(self):
+    """Return the trigger queue and dispatch counters
+
+    @return(dict) : the queue counters with the number of dispatched events
+                    and the average and maximum age of events at dispatch
+    """
+    stats = self.__queue.getStats()
+    stats['dispatched'] = self.__counter_dispatch
+    if self.__counter_dispatch:
+      stats['age_avg'] = self.__age_sum / self.__counter_dispatch
+    else:
+      stats['age_avg'] = 0.0
+    stats['age_max'] = self.__age_max
+    stats['age_max_class'] = dict(self.__d_age_max)
+    stats['retrying'] = len(self.__l_retry)
+    stats['running'] = self.__runner.getPending()
+    stats['suppressed'] = len(self.__d_suppressed)
+    stats['dead_letter'] = self.__dead_letter.getCounter()
+    return stats
+
+  def getDeadLetters(self):
+    """Return the last events which have failed after all their retries
+
+    @return(list) : the list of dead letter dict
+    """
+    return self.__dead_letter.getLetters()
+
   def serve_once(self):
     """Handle only one event from the queue if available
 
+    Digest batches whose window has expired are delivered too
     @return[boolean] : True if a trigger has been serve
                         False there is no trigger in queue
     """
+    self.__releaseSuppressed()
+    self.__serveAsync()
+    self.__flushDigest()
+    self.__serveRetry()
     if self.__queue.empty():
+      self.__syncJournal()
       return False
-    value = self.__queue.get_nowait()
+    event = self.__queue.get_nowait()
     sys_log.info('[TRIGGER] Trigger for client [' +
-                 value['name'] + ']')
-    self.__do(value)
+                 event.value['name'] + ']')
+    self.__do(event)
+    self.__syncJournal()
     return True
 
   def serve(self):
     """Handle all event from the queue undefinitly
     """
     while True:
-      value = self.__queue.get(True)
-      sys_log.info('[TRIGGER] Trigger for client [' +
-                   value['name'] + ']')
-      self.__do(value)
+      self.__releaseSuppressed()
+      try:
+        event = self.__queue.get(True, self.__getWaitTimeout())
+      except Empty:
+        event = None
+      if event is not None:
+        sys_log.info('[TRIGGER] Trigger for client [' +
+                     event.value['name'] + ']')
+        self.__do(event)
+      self.__serveAsync()
+      self.__flushDigest()
+      self.__serveRetry()
+      self.__syncJournal()
 
-  def __do(self, value):
-    """Send a trig event to all registered trigger objects
+  def flush(self):
+    """Deliver all suppressed events and pending digest batches without
+    waiting for their rate limit or window
 
-    @param(dict) value : a set of value to pass to all trigger
+    This must be called before exiting to not lose buffered events
     """
-    if value is None:
-      return
+    self.__releaseSuppressed(force=True)
+    while self.serve_once():
+      pass
+    self.__flushDigest(force=True)
+    # wait for the running coroutine triggers
+    timeout = max([t.getDoTimeout() for t in self.__l_trigger] + [0])
+    if not self.__runner.join(timeout or None):
+      sys_log.warning('[TRIGGER] ' + str(self.__runner.getPending()) +
+                      ' coroutine trigger(s) still running on exit')
+    self.__serveAsync()
+
+  def close(self):
+    """Tell all triggers to release their resources and close the journal
+    """
+    if self.__l_retry:
+      sys_log.warning('[TRIGGER] ' + str(len(self.__l_retry)) +
+                      ' event(s) still waiting for retry on exit')
+    self.__runner.stop()
+    if self.__journal:
+      self.__journal.close()
     for t in self.__l_trigger:
       try:
-        if not t.do(value):
-          sys_log.error('[TRIGGER] Trigger "' + t.getName() +
-                        '" has encounter an error during do()')
-      except KeyError as e:
+        t.close()
+      except Exception as e:
+        sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                      '" has encounter an error during close(): ' + str(e))
+
+  def __do(self, event):
+    """Send a trig event to all trigger objects selected by the routing table
+
+    Triggers which have a digest window only buffer the event, it will be
+    delivered later with all other events received during the window
+    @param(TriggerEvent) event : the event to pass to all trigger
+    """
+    if event is None:
+      return
+    age = time.monotonic() - event.time
+    self.__counter_dispatch += 1
+    self.__age_sum += age
+    self.__age_max = max(self.__age_max, age)
+    name = self.getPriorityClass(event.value)
+    self.__d_age_max[name] = max(self.__d_age_max.get(name, 0.0), age)
+
+    l_trigger = self.__router.route(event.value)
+    if event.targets is not None:
+      l_trigger = [t for t in l_trigger if t.getName() in event.targets]
+    event.remaining = set([t.getName() for t in l_trigger])
+    if not l_trigger and self.__journal and event.id is not None:
+      self.__journal.complete(event.id)
+    for t in l_trigger:
+      window = t.getDigestWindow()
+      if window > 0:
+        if t not in self.__d_digest:
+          self.__d_digest[t] = [time.monotonic() + window, []]
+        self.__d_digest[t][1].append(event)
+      else:
+        self.__deliver(t, [event], False)
+
+  def __deliver(self, t, l_event, batch, attempt=0):
+    """Give some events to a trigger and schedule a retry if it fail
+
+    @param(TriggerHandler) t : the trigger object
+    @param(list) l_event : the list of TriggerEvent to deliver
+    @param(boolean) batch : if True use do_batch() instead of do()
+    @param(int) attempt : the number of previous failed attempts
+    """
+    if batch:
+      result = self.__call(t, t.do_batch, [e.value for e in l_event])
+    else:
+      result = self.__call(t, t.do, l_event[0].value)
+    if inspect.isawaitable(result):
+      self.__runner.submit(result,
+                           t.getDoTimeout() or None,
+                           (t, l_event, batch, attempt))
+      return
+    self.__result(t, l_event, batch, attempt, result)
+
+  def __serveAsync(self):
+    """Handle the results of the finished coroutine triggers
+    """
+    for context, result, error in self.__runner.getResults():
+      t, l_event, batch, attempt = context
+      if isinstance(error, asyncio.TimeoutError):
+        sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                      '" has timed out after ' + str(t.getDoTimeout()) + 's')
+      elif isinstance(error, KeyError):
         sys_log.error('[TRIGGER] Trigger "' + t.getName() +
-                      '" require a missing parameters "' + str(e) +
+                      '" require a missing parameters "' + str(error) +
                       '" see trigger documentation')
-      except Exception as e:
+      elif error is not None:
+        sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                      '" has encounter an error: ' + str(error))
+      elif not result or (isinstance(result, list) and not all(result)):
         sys_log.error('[TRIGGER] Trigger "' + t.getName() +
-                      '" has encounter an error: ' + str(e))
+                      '" has encounter an error during coroutine')
+      self.__result(t, l_event, batch, attempt, error is None and result)
+
+  def __result(self, t, l_event, batch, attempt, result):
+    """Record the result of a trigger and schedule a retry if it has failed
+
+    @param(TriggerHandler) t : the trigger object
+    @param(list) l_event : the list of delivered TriggerEvent
+    @param(boolean) batch : if True do_batch() has been used instead of do()
+    @param(int) attempt : the number of previous failed attempts
+    @param(boolean|list) result : the trigger result, or the result of each
+                                  event for a batch
+    """
+    if isinstance(result, list):
+      # only the failed events of a batch are given again
+      self.__done(t, [e for e, r in zip(l_event, result) if r])
+      l_event = [e for e, r in zip(l_event, result) if not r]
+      if not l_event:
+        return
+    elif result:
+      self.__done(t, l_event)
+      return
+
+    attempt += 1
+    if attempt > t.getRetry():
+      for event in l_event:
+        self.__dead_letter.add(t.getName(), event.value, attempt)
+      sys_log.error('[TRIGGER] Trigger "' + t.getName() + '" has failed ' +
+                    str(attempt) + ' time(s), ' + str(len(l_event)) +
+                    ' event(s) moved to dead letter')
+      self.__done(t, l_event)
+      return
+
+    # exponential backoff with a random jitter in the upper half of the delay
+    first, maximum = t.getRetryDelay()
+    delay = min(maximum, first * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    heapq.heappush(self.__l_retry, (time.monotonic() + delay,
+                                    next(self.__retry_seq),
+                                    t, l_event, batch, attempt))
+    sys_log.info('[TRIGGER] Trigger "' + t.getName() + '" will retry ' +
+                 str(len(l_event)) + ' event(s) in ' +
+                 str(round(delay, 1)) + 's')
+
+  def __serveRetry(self):
+    """Deliver again the failed events whose retry delay has expired
+    """
+    now = time.monotonic()
+    while self.__l_retry and self.__l_retry[0][0] <= now:
+      due, seq, t, l_event, batch, attempt = heapq.heappop(self.__l_retry)
+      self.__deliver(t, l_event, batch, attempt)
+
+  def __done(self, t, l_event):
+    """Record that a trigger has finished with some events
+
+    The events are acknowledged in the journal, and an event handled
+    by all its triggers is removed from the journal
+    @param(TriggerHandler) t : the trigger object
+    @param(list) l_event : the list of handled TriggerEvent
+    """
+    if self.__journal is None:
+      return
+    for event in l_event:
+      if event.id is None:
+        continue
+      self.__journal.ack(event.id, t.getName())
+      event.remaining.discard(t.getName())
+      if not event.remaining:
+        self.__journal.complete(event.id)
+
+  def __syncJournal(self):
+    """Write the journal on disk if needed
+    """
+    if self.__journal:
+      self.__journal.sync()
+
+  def __flushDigest(self, force=False):
+    """Deliver the digest batches whose window has expired
+
+    @param(boolean) force : if True deliver all batches whatever their deadline
+    """
+    now = time.monotonic()
+    for t in list(self.__d_digest):
+      deadline, l_event = self.__d_digest[t]
+      if force or deadline <= now:
+        del self.__d_digest[t]
+        sys_log.info('[TRIGGER] Digest of ' + str(len(l_event)) +
+                     ' event(s) for trigger "' + t.getName() + '"')
+        self.__deliver(t, l_event, True)
+
+  def __getWaitTimeout(self):
+    """Return the time to wait for a new event before the next timed task
+
+    @return(float) : the number of seconds to wait
+             None if there is no pending digest, retry nor journal to sync
+    """
+    l_timeout = []
+    if self.__l_retry:
+      l_timeout.append(max(0, self.__l_retry[0][0] - time.monotonic()))
+    if self.__d_suppressed:
+      with self.__lock_suppressed:
+        l_timeout.append(min([self.__ratelimit.getDelay(name)
+                              for name in self.__d_suppressed]))
+    if self.__d_digest:
+      deadline = min([d[0] for d in self.__d_digest.values()])
+      l_timeout.append(max(0, deadline - time.monotonic()))
+    if self.__journal and self.__journal.getSyncTimeout() is not None:
+      l_timeout.append(self.__journal.getSyncTimeout())
+    if not l_timeout:
+      return None
+    return min(l_timeout)
+
+  def __call(self, t, func, value):
+    """Run a trigger function and log all encountered errors
+
+    @param(TriggerHandler) t : the trigger object
+    @param(function) func : the bound trigger method to call
+    @param(dict|list) value : the event or the list of event to pass to func
+    @return(boolean) : True if the trigger success
+                        False otherwise
+                       or the list of result of each event of a batch
+                       or the awaitable returned by a coroutine function
+    """
+    try:
+      result = func(value)
+      if inspect.isawaitable(result):
+        return result
+      if isinstance(result, list):
+        if not all(result):
+          sys_log.error('[TRIGGER] Trigger "' + t.getName() + '" has failed ' +
+                        str(result.count(False)) + ' event(s) during ' +
+                        func.__name__ + '()')
+        return result
+      if result:
+        return True
+      sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                    '" has encounter an error during ' + func.__name__ + '()')
+    except KeyError as e:
+      sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                    '" require a missing parameters "' + str(e) +
+                    '" see trigger documentation')
+    except Exception as e:
+      sys_log.error('[TRIGGER] Trigger "' + t.getName() +
+                    '" has encounter an error: ' + str(e))
+    return False
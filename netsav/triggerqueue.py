@@ -0,0 +1,290 @@
+# -*-coding:Utf-8 -*
+
+# This file is a part of netsav
+#
+# Copyright (c) 2014-2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""NETSAV/triggerqueue module
+
+It provide the bounded queue in which trigger events wait to be handled
+"""
+
+# System imports
+from collections import deque
+from queue import Empty
+import threading
+import time
+
+# Projet Imports
+
+
+class TriggerQueue:
+  """A thread safe bounded priority queue of trigger events
+
+  Events are stored in one FIFO lane per priority level, the level 0 is the
+  most important one. The next event is taken from the lane with the best
+  priority, but an event waiting since 'aging' seconds gains one level for
+  each of these periods so the low priority events cannot starve.
+  The events of a client are always handled in their arrival order, a new
+  event is never put in a better lane than the queued events of its client,
+  else a recovery could be notified before the failure it ends.
+
+  When the queue is full, a new event is handled according to the overflow
+  policy :
+    drop_oldest : the oldest event of the lowest priority lane is dropped
+    drop_newest : the new event is dropped
+    collapse : the queued event of the same client is replaced by the new one,
+               so only the latest state of a client is kept. If there is no
+               queued event for this client the oldest one is dropped
+  When de-duplication is enabled, an event identical to the last queued
+  event of its client is dropped whatever the queue size
+  """
+
+  POLICIES = ['drop_oldest', 'drop_newest', 'collapse']
+
+  def __init__(self, capacity=0, policy='drop_oldest', dedup=False,
+               levels=1, aging=0):
+    """Constructor : Build an empty queue
+
+    @param[int] capacity : the maximum number of events, 0 for unlimited
+    @param[string] policy : the overflow policy name
+    @param[boolean] dedup : if True drop the events identical to the last
+                            queued one of their client
+    @param[int] levels : the number of priority levels
+    @param[float] aging : the waiting time after which an event gains one
+                          priority level, 0 to disable aging
+    """
+    if policy not in self.POLICIES:
+      raise ValueError('Unknown queue overflow policy "' + str(policy) + '"')
+    self.capacity = capacity
+    self.policy = policy
+    self.aging = aging
+    self._l_lane = [deque() for i in range(max(1, levels))]
+    self._size = 0
+    self._cond = threading.Condition(threading.Lock())
+    # if a waiting get() must return without event
+    self._interrupted = False
+    self.dedup = dedup
+    # queued events of each client in their arrival order
+    self._d_client = dict()
+    # overflow counters
+    self._counter_drop = 0
+    self._counter_collapse = 0
+    self._counter_duplicate = 0
+
+  def put(self, event):
+    """Put an event in the lane of its priority
+
+    @param[TriggerEvent] event : the event to queue
+    @return[list] : the events which have been removed from the queue
+                    because of the overflow, it may contains the given event
+                    None if the event is a duplicate and has not been queued
+    """
+    with self._cond:
+      l_client = self._d_client.get(event.value['name'])
+      if (self.dedup and l_client and
+          self._getKey(l_client[-1].value) == self._getKey(event.value)):
+        self._counter_duplicate += 1
+        return None
+      l_drop = []
+      if self.capacity > 0 and self._size >= self.capacity:
+        if self.policy == 'drop_newest':
+          self._counter_drop += 1
+          return [event]
+        found = None
+        if self.policy == 'collapse':
+          found = self._findClient(event.value['name'])
+        if found is not None:
+          lane, index = found
+          self._counter_collapse += 1
+        else:
+          lane = self._getLowestLane()
+          index = 0
+          self._counter_drop += 1
+        l_drop.append(lane[index])
+        del lane[index]
+        self._size -= 1
+        self._remove(l_drop[0])
+      # keep the order of the events of the client
+      l_client = self._d_client.get(event.value['name'])
+      if l_client:
+        event.priority = max(event.priority, l_client[-1].priority)
+      self._getLane(event).append(event)
+      self._size += 1
+      self._add(event)
+      self._cond.notify()
+      return l_drop
+
+  def get(self, block=True, timeout=None):
+    """Remove and return the most important event of the queue
+
+    @param[boolean] block : if True wait until an event is available
+    @param[float] timeout : the maximum time to wait, None for unlimited
+    @return[TriggerEvent] : the event
+    @raise[queue.Empty] : if no event is available or if interrupted
+    """
+    with self._cond:
+      if block:
+        if timeout is None:
+          while not self._size and not self._interrupted:
+            self._cond.wait()
+        else:
+          deadline = time.monotonic() + timeout
+          while not self._size and not self._interrupted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+              break
+            self._cond.wait(remaining)
+      self._interrupted = False
+      if not self._size:
+        raise Empty
+      event = self._getBestLane().popleft()
+      self._size -= 1
+      self._remove(event)
+      return event
+
+  def interrupt(self):
+    """Make the current or next blocking get() return immediately
+    """
+    with self._cond:
+      self._interrupted = True
+      self._cond.notify()
+
+  def get_nowait(self):
+    """Remove and return the most important event without waiting
+
+    @return[TriggerEvent] : the event
+    @raise[queue.Empty] : if no event is available
+    """
+    return self.get(False)
+
+  def empty(self):
+    """Return True if the queue is empty
+    """
+    return self.qsize() == 0
+
+  def qsize(self):
+    """Return the number of queued events
+    """
+    with self._cond:
+      return self._size
+
+  def getStats(self):
+    """Return the queue counters
+
+    @return[dict] : the 'depth', 'capacity', 'dropped', 'collapsed' and
+                    'duplicate' counters, with 'lanes' the list of depth of
+                    each priority lane
+    """
+    with self._cond:
+      return {'depth': self._size,
+              'lanes': [len(lane) for lane in self._l_lane],
+              'capacity': self.capacity,
+              'dropped': self._counter_drop,
+              'collapsed': self._counter_collapse,
+              'duplicate': self._counter_duplicate}
+
+  def _getLane(self, event):
+    """Return the lane of an event according to its priority
+
+    @param[TriggerEvent] event : the event
+    @return[deque] : the lane
+    """
+    level = min(max(0, event.priority), len(self._l_lane) - 1)
+    return self._l_lane[level]
+
+  def _getBestLane(self):
+    """Return the lane which contains the next event (the lock must be hold)
+
+    Only the first event of each lane is compared because it is the oldest
+    one, so it has the best aged priority of its lane
+    @return[deque] : the lane
+    """
+    now = time.monotonic()
+    best = None
+    best_key = None
+    for level, lane in enumerate(self._l_lane):
+      if not lane:
+        continue
+      effective = level
+      if self.aging > 0:
+        effective -= int((now - lane[0].time) / self.aging)
+      key = (effective, lane[0].time)
+      if best_key is None or key < best_key:
+        best = lane
+        best_key = key
+    return best
+
+  def _getLowestLane(self):
+    """Return the least important non empty lane (the lock must be hold)
+
+    @return[deque] : the lane
+    """
+    for lane in reversed(self._l_lane):
+      if lane:
+        return lane
+    return None
+
+  def _add(self, event):
+    """Record a new queued event of a client (the lock must be hold)
+
+    @param[TriggerEvent] event : the queued event
+    """
+    self._d_client.setdefault(event.value['name'], deque()).append(event)
+
+  def _remove(self, event):
+    """Forget a removed event of a client (the lock must be hold)
+
+    @param[TriggerEvent] event : the removed event
+    """
+    name = event.value['name']
+    l_client = self._d_client.get(name)
+    if l_client is None:
+      return
+    if l_client and l_client[0] is event:
+      l_client.popleft()
+    else:
+      l_client.remove(event)
+    if not l_client:
+      del self._d_client[name]
+
+  @staticmethod
+  def _getKey(value):
+    """Return a hashable key which identify an event value
+
+    @param[dict] value : the event value
+    @return[tuple] : the key
+    """
+    return tuple(sorted((k, str(v)) for k, v in value.items()))
+
+  def _findClient(self, name):
+    """Return the position of the queued event of a client (the lock must be
+    hold)
+
+    @param[string] name : the client name
+    @return[tuple] : the (lane, index) pair, None if there is no event for
+                      this client
+    """
+    l_client = self._d_client.get(name)
+    if not l_client:
+      return None
+    lane = self._getLane(l_client[0])
+    return (lane, lane.index(l_client[0]))
@@ -0,0 +1,146 @@
+# -*-coding:Utf-8 -*
+
+"""Tests of the trigger dispatch by several local cluster nodes
+"""
+
+# System imports
+import logging
+import socket
+import threading
+import time
+import unittest
+
+# Projet Imports
+from netsav.client.client import Client
+from netsav.gossip import Gossip
+from netsav.httpteepotreply.httpteepotreply import HttpTeepotReply
+from netsav.leader import LeaderElection
+from netsav.status import StatusBoard
+
+
+class RecordTrigger:
+  """Record the dispatched events
+  """
+
+  def __init__(self):
+    self.l_event = []
+
+  def trig(self, value, **kwargs):
+    self.l_event.append((value['previous_state_str'],
+                         value['current_state_str']))
+
+
+def getFreePort():
+  """Return a local TCP port which is not in use
+  """
+  s = socket.socket()
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+
+class Node:
+  """A cluster node with its server, gossip, election and one client
+  """
+
+  def __init__(self, name, port, l_peer_port):
+    self.name = name
+    self.event_stop = threading.Event()
+    self.status = StatusBoard()
+    self.gossip = Gossip(self.event_stop, self.status)
+    self.gossip.load({'name': name,
+                      'peers': ['127.0.0.1:' + str(p) for p in l_peer_port],
+                      'node_timeout': 2})
+    self.gossip.interval = 0.2
+    self.election = LeaderElection(self.event_stop, self.gossip)
+    self.election.load({'lease_duration': 3})
+    self.http = HttpTeepotReply('127.0.0.1', port, logging.getLogger('test'),
+                                log_client=False)
+    self.http.setRoute(Gossip.PATH, self.gossip.getDelta, 'application/json',
+                       query=True)
+    self.http.setRoute(LeaderElection.PATH, self.election.getLease,
+                       'application/json', query=True)
+    self.trigger = RecordTrigger()
+    self.client = Client(self.event_stop, threading.Event())
+    self.client.load({'name': 'host', 'address': '127.0.0.1', 'port': 1})
+    self.client.setTrigger(self.trigger)
+    self.client.setStatusBoard(self.status)
+    self.client.setElection(self.election)
+    self.client.setGossip(self.gossip)
+    # the state observed by the client of this node
+    self.state = Client.AVAILABLE
+    self.l_thread = [threading.Thread(target=self.http.serve),
+                     self.gossip,
+                     self.election,
+                     threading.Thread(target=self.probe)]
+
+  def probe(self):
+    while not self.event_stop.wait(0.1):
+      self.client.updateState(self.state)
+      self.client.publishState()
+
+  def start(self):
+    for thread in self.l_thread:
+      thread.daemon = True
+      thread.start()
+
+  def stop(self):
+    self.event_stop.set()
+    self.http.shutdown()
+    for thread in self.l_thread:
+      thread.join()
+    self.http.server_close()
+
+
+class TestClusterDispatch(unittest.TestCase):
+
+  def setUp(self):
+    l_port = [getFreePort() for i in range(3)]
+    self.l_node = [Node('n' + str(i), port,
+                        [p for p in l_port if p != port])
+                   for i, port in enumerate(l_port)]
+    for node in self.l_node:
+      node.start()
+
+  def tearDown(self):
+    for node in self.l_node:
+      if not node.event_stop.is_set():
+        node.stop()
+
+  def waitLeader(self, l_node, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      l_leader = [n for n in l_node if n.election.isLeader()]
+      if l_leader:
+        return l_leader[0]
+      time.sleep(0.1)
+    self.fail('no leader elected')
+
+  def waitEvents(self, l_node, count, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      if sum(len(n.trigger.l_event) for n in l_node) >= count:
+        break
+      time.sleep(0.1)
+    # let the duplicate events happen if any
+    time.sleep(1)
+    return [e for n in l_node for e in n.trigger.l_event]
+
+  def test_failover_dispatch_once(self):
+    leader = self.waitLeader(self.l_node)
+    self.assertEqual(self.waitEvents(self.l_node, 1),
+                     [('UNKNOWN', 'AVAILABLE')])
+    self.assertEqual(len(leader.trigger.l_event), 1)
+    # the leader host fails, the other nodes see it down during the vacancy
+    leader.stop()
+    l_alive = [n for n in self.l_node if n is not leader]
+    for node in l_alive:
+      node.state = Client.UNAVAILABLE
+    self.waitLeader(l_alive)
+    self.assertEqual(self.waitEvents(l_alive, 1),
+                     [('AVAILABLE', 'UNAVAILABLE')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+# -*-coding:Utf-8 -*
+
+"""Tests of the NETSAV/triggerqueue module
+"""
+
+# System imports
+import unittest
+
+# Projet Imports
+from netsav.triggerloader import TriggerEvent
+from netsav.triggerqueue import TriggerQueue
+
+# the priority levels of the default classes critical,down,up,info
+DOWN = 1
+UP = 2
+
+
+def makeEvent(name, state, priority):
+  """Build a queued event of a client state change
+  """
+  event = TriggerEvent({'name': name, 'current_state_str': state})
+  event.priority = priority
+  return event
+
+
+def drain(queue):
+  """Return the states of all queued events in their handling order
+  """
+  l_state = []
+  while not queue.empty():
+    event = queue.get_nowait()
+    l_state.append((event.value['name'], event.value['current_state_str']))
+  return l_state
+
+
+class TestTriggerQueue(unittest.TestCase):
+
+  def test_priority_between_clients(self):
+    queue = TriggerQueue(levels=4)
+    queue.put(makeEvent('a', 'AVAILABLE', UP))
+    queue.put(makeEvent('b', 'UNAVAILABLE', DOWN))
+    self.assertEqual(drain(queue), [('b', 'UNAVAILABLE'), ('a', 'AVAILABLE')])
+
+  def test_client_order_is_kept(self):
+    queue = TriggerQueue(levels=4)
+    queue.put(makeEvent('a', 'AVAILABLE', UP))
+    queue.put(makeEvent('b', 'AVAILABLE', UP))
+    queue.put(makeEvent('a', 'UNAVAILABLE', DOWN))
+    queue.put(makeEvent('c', 'UNAVAILABLE', DOWN))
+    self.assertEqual(drain(queue), [('c', 'UNAVAILABLE'),
+                                    ('a', 'AVAILABLE'),
+                                    ('b', 'AVAILABLE'),
+                                    ('a', 'UNAVAILABLE')])
+
+  def test_client_order_after_demotion(self):
+    queue = TriggerQueue(levels=4)
+    queue.put(makeEvent('a', 'AVAILABLE', UP))
+    queue.put(makeEvent('a', 'UNAVAILABLE', DOWN))
+    self.assertEqual(drain(queue), [('a', 'AVAILABLE'), ('a', 'UNAVAILABLE')])
+    # the client has no more queued event, its priority applies again
+    queue.put(makeEvent('b', 'AVAILABLE', UP))
+    queue.put(makeEvent('a', 'UNAVAILABLE', DOWN))
+    self.assertEqual(drain(queue), [('a', 'UNAVAILABLE'), ('b', 'AVAILABLE')])
+
+  def test_dedup_only_last_client_event(self):
+    queue = TriggerQueue(dedup=True, levels=4)
+    self.assertEqual(queue.put(makeEvent('a', 'UNAVAILABLE', DOWN)), [])
+    self.assertEqual(queue.put(makeEvent('a', 'AVAILABLE', UP)), [])
+    self.assertEqual(queue.put(makeEvent('a', 'UNAVAILABLE', DOWN)), [])
+    self.assertIsNone(queue.put(makeEvent('a', 'UNAVAILABLE', DOWN)))
+    self.assertEqual(drain(queue), [('a', 'UNAVAILABLE'),
+                                    ('a', 'AVAILABLE'),
+                                    ('a', 'UNAVAILABLE')])
+
+  def test_collapse_keeps_client_order(self):
+    queue = TriggerQueue(capacity=2, policy='collapse', levels=4)
+    queue.put(makeEvent('a', 'AVAILABLE', UP))
+    queue.put(makeEvent('a', 'UNAVAILABLE', DOWN))
+    l_drop = queue.put(makeEvent('a', 'AVAILABLE', DOWN))
+    self.assertEqual([e.value['current_state_str'] for e in l_drop],
+                     ['AVAILABLE'])
+    self.assertEqual(drain(queue), [('a', 'UNAVAILABLE'), ('a', 'AVAILABLE')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,103 @@
+# -*-coding:Utf-8 -*
+
+"""Tests of the webhook trigger against a local HTTP server
+"""
+
+# System imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import unittest
+
+# Projet Imports
+from netsav.asyncrunner import AsyncRunner
+from netsav.trigger.webhook import Trigger
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+  """Record the posted documents and answer after a delay
+  """
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    time.sleep(self.server.delay)
+    self.server.l_doc.append(json.loads(body.decode('utf-8')))
+    self.send_response(self.server.status)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, format, *args):
+    pass
+
+
+class TestWebhook(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookHandler)
+    self.server.l_doc = []
+    self.server.delay = 0
+    self.server.status = 200
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.runner = AsyncRunner()
+
+  def tearDown(self):
+    self.runner.stop()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def makeTrigger(self, **options):
+    trigger = Trigger()
+    config = {'name': 'webhook',
+              'url': 'http://127.0.0.1:%d/hook' % self.server.server_port}
+    config.update(options)
+    trigger.setConfiguration(config)
+    self.assertTrue(trigger.load())
+    return trigger
+
+  def run_all(self, l_coro, timeout):
+    for index, coro in enumerate(l_coro):
+      self.runner.submit(coro, timeout, index)
+    self.assertTrue(self.runner.join(10))
+    return sorted(self.runner.getResults())
+
+  def test_post_events(self):
+    trigger = self.makeTrigger()
+    l_result = self.run_all([trigger.do({'name': 'a'})], 5)
+    self.assertEqual(l_result, [(0, True, None)])
+    self.assertEqual(self.server.l_doc[0]['events'], [{'name': 'a'}])
+    trigger.close()
+
+  def test_batch_result_by_event(self):
+    trigger = self.makeTrigger(batch_size='2')
+    values = [{'name': str(i)} for i in range(3)]
+    l_result = self.run_all([trigger.do_batch(values)], 5)
+    self.assertEqual(l_result, [(0, [True, True, True], None)])
+    self.assertEqual([len(doc['events']) for doc in self.server.l_doc],
+                     [2, 1])
+    trigger.close()
+
+  def test_error_status(self):
+    self.server.status = 500
+    trigger = self.makeTrigger()
+    l_result = self.run_all([trigger.do({'name': 'a'})], 5)
+    self.assertEqual(l_result, [(0, False, None)])
+    trigger.close()
+
+  def test_waiting_for_a_slot_is_not_timed_out(self):
+    # each request last 0.4s, the third one waits 0.8s for its slot
+    self.server.delay = 0.4
+    trigger = self.makeTrigger(concurrency='1')
+    l_result = self.run_all([trigger.do({'name': str(i)}) for i in range(3)],
+                            0.7)
+    self.assertEqual([r[1:] for r in l_result], [(True, None)] * 3)
+    self.assertEqual(len(self.server.l_doc), 3)
+    trigger.close()
+
+
+if __name__ == '__main__':
+  unittest.main()